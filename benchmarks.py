@@ -0,0 +1,536 @@
+"""Micro-benchmarks for the screenshot app.
+
+Run a single benchmark by name, or all of them:
+
+    python benchmarks.py ui_insert
+    python benchmarks.py all
+
+Benchmarks that build Tk widgets need a display (a real one or Xvfb).
+"""
+import os
+import sys
+import time
+import uuid
+import statistics
+import random
+import re
+from io import BytesIO
+
+import tkinter as tk
+from PIL import Image, ImageDraw
+
+SAMPLE_RESPONSE = """## Inspector's Notes
+The unit shows **minor oil seepage** around the *rear main seal*.
+
+### Engine description
+- 2.0L inline four, turbocharged
+- Timing belt replaced at 90,000 km
+
+| Part | Condition | Action |
+|------|:---------:|-------:|
+| **Gasket** | Worn | Replace |
+| Hose | OK | Monitor |
+"""
+
+
+def _fake_capture(directory, size=(1280, 800)):
+    """A history entry whose full image is on disk, as archived captures are.
+
+    Identical captures share one file and one image hash (so one cached
+    thumbnail), like the content-addressed archive.
+    """
+    image = Image.new("RGB", size, (200, 210, 220))
+    path = os.path.join(directory, f"capture_{size[0]}x{size[1]}.png")
+    if not os.path.exists(path):
+        image.save(path)
+    return {
+        "id": str(uuid.uuid4()),
+        "image": image,
+        "image_hash": f"bench{size[0]}x{size[1]}".ljust(64, "0"),
+        "title": "Inspection Report",
+        "timestamp": time.strftime("%H:%M:%S"),
+        "path": path,
+        "api_response": SAMPLE_RESPONSE,
+    }
+
+
+def _make_app():
+    from capture_active_window import ScreenshotApp
+
+    root = tk.Tk()
+    root.withdraw()
+    app = ScreenshotApp(root)
+    app.button_window.withdraw()
+    return root, app
+
+
+def _report(name, rows):
+    print(f"\n{name}")
+    for row in rows:
+        print("  " + "  ".join(f"{k}={v}" for k, v in row.items()))
+
+
+def _fill_history(app, size, directory):
+    app.screenshot_list.clear()
+    app.capture_store.clear()
+    for _ in range(size):
+        app.screenshot_list.prepend(app.capture_store.add(_fake_capture(directory)))
+
+
+def bench_ui_insert(history_sizes=(10, 100, 1000), samples=5):
+    """Per-capture UI cost as the history grows.
+
+    With the incremental, virtualized list the cost of adding a capture
+    should not depend on how many captures came before it.
+    """
+    import shutil
+    import tempfile
+
+    root, app = _make_app()
+    directory = tempfile.mkdtemp(prefix="bench_history_")
+    rows = []
+    try:
+        for size in history_sizes:
+            _fill_history(app, size, directory)
+            root.update_idletasks()
+
+            timings = []
+            for _ in range(samples):
+                capture = app.capture_store.add(_fake_capture(directory))
+                start = time.perf_counter()
+                app.screenshot_list.prepend(capture)
+                root.update_idletasks()
+                timings.append((time.perf_counter() - start) * 1000)
+
+            rows.append({
+                "history": size,
+                "insert_ms": f"{statistics.median(timings):.1f}",
+                "live_cards": len(app.screenshot_list.live),
+            })
+    finally:
+        root.destroy()
+        shutil.rmtree(directory, ignore_errors=True)
+    _report("ui_insert: per-capture UI cost", rows)
+
+
+def bench_scroll(history_sizes=(10, 100, 1000), steps=50):
+    """Scroll latency and materialized widget count vs. session length"""
+    import shutil
+    import tempfile
+
+    root, app = _make_app()
+    root.deiconify()
+    directory = tempfile.mkdtemp(prefix="bench_history_")
+    rows = []
+    try:
+        for size in history_sizes:
+            _fill_history(app, size, directory)
+            root.update()
+
+            timings = []
+            max_live = 0
+            for step in range(steps):
+                start = time.perf_counter()
+                app.canvas.yview_moveto(step / steps)
+                app.screenshot_list.refresh()
+                root.update_idletasks()
+                timings.append((time.perf_counter() - start) * 1000)
+                max_live = max(max_live, len(app.screenshot_list.live))
+
+            rows.append({
+                "history": size,
+                "scroll_p50_ms": f"{statistics.median(timings):.1f}",
+                "scroll_max_ms": f"{max(timings):.1f}",
+                "max_live_cards": max_live,
+            })
+    finally:
+        root.destroy()
+        shutil.rmtree(directory, ignore_errors=True)
+    _report("scroll: latency per scroll step", rows)
+
+
+def _fake_window(size):
+    """A window-like test image: flat chrome, text lines and a photo area"""
+    rng = random.Random(42)
+    img = Image.new("RGB", size, (245, 247, 250))
+    draw = ImageDraw.Draw(img)
+    width, height = size
+    draw.rectangle((0, 0, width, 40), fill=(74, 107, 175))
+    for y in range(60, height - 20, 18):
+        words = " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+                         for _ in range(width // 60))
+        draw.text((20, y), words, fill=(38, 50, 56))
+    photo = Image.effect_noise((width // 3, height // 3), 40).convert("RGB")
+    img.paste(photo, (width - width // 3 - 20, 60))
+    return img
+
+
+def bench_encode(sizes=((1280, 800), (1920, 1080), (3840, 2160)), repeats=3):
+    """ms and bytes per encode stage for typical window sizes.
+
+    "legacy" is the old compress_image path: LANCZOS resize, optimized PNG,
+    decode, optimized PNG again, plus the full-resolution PNG save.
+    """
+    from capture_core import ImageEncoder
+
+    def timed(fn):
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    rows = []
+    for size in sizes:
+        image = _fake_window(size)
+        label = f"{size[0]}x{size[1]}"
+
+        def legacy():
+            resized = image.resize((1024, int(size[1] * 1024 / size[0])), Image.LANCZOS)
+            buf = BytesIO()
+            resized.save(buf, format="PNG", optimize=True)
+            buf.seek(0)
+            reloaded = Image.open(buf)
+            upload = BytesIO()
+            reloaded.save(upload, format="PNG", optimize=True)
+            archive = BytesIO()
+            image.save(archive, format="PNG")
+            return len(upload.getvalue()), len(archive.getvalue())
+
+        ms, (upload_bytes, archive_bytes) = timed(legacy)
+        rows.append({"size": label, "pipeline": "legacy", "total_ms": f"{ms:.0f}",
+                     "upload_bytes": upload_bytes, "archive_bytes": archive_bytes})
+
+        for fmt, quality in (("png", None), ("webp", 80), ("jpeg", 80)):
+            encoder = ImageEncoder(upload_format=fmt, upload_quality=quality or 80)
+            upload_ms, encoded = timed(lambda: encoder.encode_upload(image))
+            archive_ms, archive = timed(
+                lambda: encoder.encode(image, "png", compress_level=encoder.archive_compress_level))
+            rows.append({
+                "size": label,
+                "pipeline": fmt,
+                "resize_ms": f"{encoded.timings['resize']:.0f}",
+                "encode_ms": f"{encoded.timings['encode']:.0f}",
+                "archive_ms": f"{archive_ms:.0f}",
+                "total_ms": f"{upload_ms + archive_ms:.0f}",
+                "upload_bytes": len(encoded.data),
+                "archive_bytes": len(archive.getvalue()),
+            })
+    _report("encode: per-stage cost per capture", rows)
+
+
+def bench_grab(sizes=((800, 600), (1920, 1080)), repeats=10):
+    """XShm region grab vs. pyautogui.screenshot(region=...).
+
+    Run against a real display or Xvfb, e.g.
+        Xvfb :99 -screen 0 3840x2160x24 & DISPLAY=:99 python benchmarks.py grab
+    """
+    import pyautogui
+    from capture_core import XShmCapture
+
+    shm = XShmCapture()
+    rows = []
+    try:
+        for width, height in sizes:
+            for name, grab in (
+                ("xshm", lambda: shm.grab(0, 0, width, height)),
+                ("pyautogui", lambda: pyautogui.screenshot(region=(0, 0, width, height))),
+            ):
+                timings = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    grab()
+                    timings.append((time.perf_counter() - start) * 1000)
+                rows.append({
+                    "size": f"{width}x{height}",
+                    "backend": name,
+                    "p50_ms": f"{statistics.median(timings):.1f}",
+                    "max_ms": f"{max(timings):.1f}",
+                })
+    finally:
+        shm.close()
+    _report("grab: region capture latency", rows)
+
+
+def _long_response(paragraphs=40, table_rows=200):
+    """A long model-style answer: prose with inline formatting plus a big table"""
+    rng = random.Random(7)
+    lines = ["# Inspection Report", ""]
+    for i in range(paragraphs):
+        lines.append(f"## Section {i}")
+        lines.append(
+            f"The **{rng.choice(['gasket', 'hose', 'belt'])}** shows *{rng.choice(['wear', 'seepage'])}*; "
+            f"see [bulletin {i}](http://example.com/{i}) for the **recommended** fix."
+        )
+        lines.append(f"- item {i} checked")
+        lines.append("")
+    lines.append("| Part | Condition | Action | Notes |")
+    lines.append("|------|:---------:|-------:|-------|")
+    for i in range(table_rows):
+        lines.append(f"| **Part {i}** | *Worn* | Replace | Check again at {i * 1000} km |")
+    return "\n".join(lines)
+
+
+def _apply_ms(runs, repeats):
+    """Median time to insert parsed runs into a MarkdownText widget"""
+    from capture_active_window import MarkdownText
+
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return "n/a (no display)"
+    try:
+        widget = MarkdownText(root)
+        timings = []
+        for _ in range(repeats):
+            widget.delete(1.0, tk.END)
+            start = time.perf_counter()
+            widget.apply_runs(runs)
+            root.update_idletasks()
+            timings.append((time.perf_counter() - start) * 1000)
+        return f"{statistics.median(timings):.2f}"
+    finally:
+        root.destroy()
+
+
+def bench_markdown(repeats=5):
+    """Parse (cold and cached) and widget apply time for a long response"""
+    from capture_active_window import MarkdownParser, MarkdownCache
+
+    text = _long_response()
+    parse_ms = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        runs = MarkdownParser().parse(text)
+        parse_ms.append((time.perf_counter() - start) * 1000)
+
+    cache = MarkdownCache()
+    cache.get_runs(text)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        cache.get_runs(text)
+    cached_ms = (time.perf_counter() - start) * 1000 / repeats
+
+    row = {
+        "chars": len(text),
+        "runs": len(runs),
+        "parse_ms": f"{statistics.median(parse_ms):.2f}",
+        "cached_ms": f"{cached_ms:.3f}",
+    }
+    row["apply_ms"] = _apply_ms(runs, repeats)
+    _report("markdown: parse and apply a long response with a 200-row table", [row])
+
+
+def _legacy_inline(line):
+    """The old process_inline_markdown loop: three searches and a slice per token"""
+    runs = []
+    remaining = line
+    while remaining:
+        found = []
+        for tag, pattern in (("bold", r'\*\*(.*?)\*\*'), ("italic", r'\*(.*?)\*'), ("link", r'\[(.*?)\]\((.*?)\)')):
+            match = re.search(pattern, remaining)
+            if match:
+                found.append((match.start(), match.end(), tag, match.group(1)))
+        if not found:
+            runs.append((remaining, ()))
+            break
+        start, end, tag, content = min(found)
+        if start:
+            runs.append((remaining[:start], ()))
+        runs.append((content, (tag,)))
+        remaining = remaining[end:]
+    return runs
+
+
+def bench_inline(lengths=(1_000, 10_000, 50_000), repeats=3):
+    """Inline tokenizer vs. the old loop on long single lines of model output"""
+    from capture_active_window import tokenize_inline
+
+    rng = random.Random(3)
+    mixes = {
+        "mixed": ["The **gasket** shows *minor seepage*; ", "see [bulletin](http://example.com/b) ",
+                  "and `code_ref()` for ", "***critical*** parts, ", "plain words with no markup at all, "],
+        # No links: the old loop rescans the whole remainder for one every step
+        "no_links": ["The **gasket** shows *minor seepage*; ", "***critical*** parts, ",
+                     "plain words with no markup at all, "],
+    }
+    rows = []
+    for (mix, pieces), length in ((m, n) for m in mixes.items() for n in lengths):
+        line = ""
+        while len(line) < length:
+            line += rng.choice(pieces)
+        row = {"mix": mix, "chars": len(line)}
+        for name, fn in (("single_pass", tokenize_inline), ("legacy", _legacy_inline)):
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn(line)
+                elapsed = (time.perf_counter() - start) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            row[f"{name}_ms"] = f"{best:.2f}"
+        rows.append(row)
+    _report("inline: tokenize one long line", rows)
+
+
+def bench_table(row_counts=(50, 200, 1000), repeats=3):
+    """Table layout time for large tables with formatted cells"""
+    from capture_active_window import MarkdownParser
+
+    rows = []
+    for count in row_counts:
+        text = _long_response(paragraphs=0, table_rows=count)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            runs = MarkdownParser().parse(text)
+            timings.append((time.perf_counter() - start) * 1000)
+        rows.append({
+            "rows": count,
+            "layout_ms": f"{statistics.median(timings):.2f}",
+            "runs": len(runs),
+            "apply_ms": _apply_ms(runs, repeats),
+        })
+    _report("table: layout and apply", rows)
+
+
+def bench_diff(sizes=((1920, 1080), (3840, 2160)), repeats=20):
+    """ms per megapixel for the repeat-capture frame diff."""
+    from capture_core import FrameDiffer
+
+    rows = []
+    for size in sizes:
+        image = _fake_window(size)
+        edited = image.copy()
+        ImageDraw.Draw(edited).rectangle((100, 100, 400, 200), fill=(255, 0, 0))
+        for use_numpy in (True, False):
+            differ = FrameDiffer()
+            if not use_numpy:
+                differ.np = None
+            elif differ.np is None:
+                continue
+            differ.compare("window", image)
+            start = time.perf_counter()
+            for i in range(repeats):
+                differ.compare("window", edited if i % 2 else image)
+            ms = (time.perf_counter() - start) * 1000 / repeats
+            rows.append({"size": f"{size[0]}x{size[1]}", "numpy": use_numpy,
+                         "ms": f"{ms:.2f}", "ms_per_mpx": f"{ms / (size[0] * size[1] / 1e6):.3f}"})
+    _report("Frame diff", rows)
+
+
+def bench_storage(sessions=20, files_per_session=250, file_bytes=64 * 1024):
+    """Temp quota enforcement over a synthetic tree of thousands of files.
+
+    Half the sessions are backdated past the age quota; the size quota is
+    set to a quarter of what remains, so both eviction rules do work.
+    """
+    import os
+    import shutil
+    import tempfile
+    from capture_core import TempStorageManager
+
+    root = tempfile.mkdtemp(prefix="bench_storage_")
+    try:
+        now = time.time()
+        blob = b"\0" * file_bytes
+        for session in range(sessions):
+            directory = os.path.join(root, f"es_screenshots_{session:04d}")
+            os.makedirs(directory)
+            age = (48 if session < sessions // 2 else 1) * 3600
+            for i in range(files_per_session):
+                path = os.path.join(directory, f"payload_{i}.json")
+                with open(path, "wb") as f:
+                    f.write(blob)
+                mtime = now - age + session * 60 + i
+                os.utime(path, (mtime, mtime))
+
+        total = sessions * files_per_session * file_bytes
+        manager = TempStorageManager(root, max_bytes=total // 8, max_age=24 * 3600,
+                                     protect=[os.path.join(root, f"es_screenshots_{sessions - 1:04d}")])
+        start = time.perf_counter()
+        before = manager.usage()
+        scan_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        removed, freed = manager.enforce()
+        enforce_ms = (time.perf_counter() - start) * 1000
+        after = manager.last_usage
+        _report("Temp storage", [{
+            "files_before": before["files"], "files_after": after["files"],
+            "sessions_after": after["directories"], "removed": removed,
+            "mb_after": f"{after['bytes'] / (1024 * 1024):.1f}",
+            "quota_mb": f"{manager.max_bytes / (1024 * 1024):.1f}",
+            "scan_ms": f"{scan_ms:.0f}", "enforce_ms": f"{enforce_ms:.0f}",
+        }])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_thumbnail(sizes=((1920, 1080), (3840, 2160)), repeats=5):
+    """ms per card thumbnail: the old full LANCZOS resize vs the cached tier.
+
+    "legacy" is what binding a card used to cost on the UI thread. "make"
+    is the one-off reduce + LANCZOS on the pipeline worker; "disk" is a
+    later session loading the cached JPEG; "memory" is a re-rendered card.
+    """
+    import shutil
+    import tempfile
+    from capture_core import ThumbnailCache
+
+    def timed(fn):
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    directory = tempfile.mkdtemp(prefix="bench_thumbnails_")
+    rows = []
+    try:
+        for size in sizes:
+            image = _fake_window(size)
+            image_hash = f"{size[0]}x{size[1]}".ljust(64, "0")
+            legacy = timed(lambda: image.resize((600, int(size[1] * 600 / size[0])), Image.LANCZOS))
+            cache = ThumbnailCache(directory)
+            make = timed(lambda: cache.create(image_hash, image))
+            disk = timed(lambda: ThumbnailCache(directory).load(image_hash, None))
+            memory = timed(lambda: cache.get(image_hash))
+            rows.append({"size": f"{size[0]}x{size[1]}", "legacy_ms": f"{legacy:.1f}",
+                         "make_ms": f"{make:.1f}", "disk_ms": f"{disk:.1f}",
+                         "memory_ms": f"{memory:.3f}", "saved_per_card_ms": f"{legacy - memory:.1f}"})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    _report("Thumbnails", rows)
+
+
+BENCHMARKS = {
+    "ui_insert": bench_ui_insert,
+    "scroll": bench_scroll,
+    "encode": bench_encode,
+    "grab": bench_grab,
+    "markdown": bench_markdown,
+    "inline": bench_inline,
+    "table": bench_table,
+    "diff": bench_diff,
+    "storage": bench_storage,
+    "thumbnail": bench_thumbnail,
+}
+
+
+def main(argv):
+    names = argv[1:] or ["all"]
+    if names == ["all"]:
+        names = list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}. Available: {', '.join(BENCHMARKS)}")
+            return 1
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
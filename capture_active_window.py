@@ -1,51 +1,175 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext
-import pyautogui
 import time
 import os
+import sys
 import platform
 import tempfile
 import threading
-import base64
 from PIL import Image, ImageTk
-from io import BytesIO
-from datetime import datetime
 import json
-import uuid
+import hashlib
 import requests
 import re
+import bisect
+from collections import OrderedDict, deque
 from itertools import cycle
 
-class MarkdownText(tk.Text):
-    """A Text widget with improved Markdown rendering capabilities"""
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.tag_configure("bold", font=("Courier", 10, "bold"))
-        self.tag_configure("italic", font=("Courier", 10, "italic"))
-        self.tag_configure("heading1", font=("Courier", 14, "bold"))
-        self.tag_configure("heading2", font=("Courier", 12, "bold"))
-        self.tag_configure("heading3", font=("Courier", 11, "bold"))
-        self.tag_configure("code", background="#f0f0f0", font=("Courier", 9))
-        self.tag_configure("bullet", lmargin1=20, lmargin2=30)
-        self.tag_configure("link", foreground="blue", underline=1)
+from capture_core import (
+    CaptureBatcher,
+    CapturePipeline,
+    CaptureProcessor,
+    LatencyStats,
+    TempStorageManager,
+    default_backends,
+    load_settings,
+    make_thumbnail,
+)
 
-        # Table styling with background colors
-        self.tag_configure("table_border", foreground="#555555")
-        self.tag_configure("table_header", 
-                        font=("Courier", 10, "bold"), 
-                        foreground="#000000",
-                        background="#e1e5eb")  # Light gray background for header
-        self.tag_configure("table_row_even", 
-                        foreground="#333333",
-                        background="#f5f7fa")  # Very light gray for even rows
-        self.tag_configure("table_row_odd", 
-                        foreground="#333333",
-                        background="#ffffff")  # White for odd rows
+# One pass over a line finds every inline construct: code spans, links and
+# runs of emphasis delimiters. Everything between matches is plain text.
+# Link text and targets stop at the next "[", so a line full of unclosed
+# brackets is still scanned once rather than once per bracket.
+INLINE_TOKEN = re.compile(r'(`+)(.+?)\1|\[([^\[\]\n]*)\]\(([^)\[\s]*)\)|\*{1,3}|_{1,3}')
 
-    def insert_markdown(self, text):
-        """Parse and insert markdown text"""
-        # Clear current content
-        self.delete(1.0, tk.END)
+INLINE_SPECIAL = re.compile(r'[*_`\[]')
+
+EMPHASIS_TAGS = {
+    (True, False): ("bold",),
+    (False, True): ("italic",),
+    (True, True): ("bold_italic",),
+    (False, False): (),
+}
+
+
+def tokenize_inline(line):
+    """Split a line into (text, tags) runs in a single linear pass.
+
+    Emphasis delimiters (*, **, ***, and the _ forms) are paired the way
+    CommonMark does it: each closer searches the opener stack, and a failed
+    search records how far down it looked (per delimiter char, opener
+    ability and run length mod 3) so later closers never rescan that part.
+    That keeps pairing linear and lets **bold *and italic*** and
+    *italic **bold** italic* nest. Unpaired delimiters stay literal.
+    Code spans are literal; links keep only their text.
+    """
+    if not INLINE_SPECIAL.search(line):
+        return [(line, ())] if line else []
+
+    # ["text"|"code"|"link", text] or
+    # ["delim", char, count, can_open, can_close, length, closes, opens]
+    tokens = []
+    pos = 0
+    for match in INLINE_TOKEN.finditer(line):
+        start, end = match.span()
+        if start > pos:
+            tokens.append(["text", line[pos:start]])
+        pos = end
+        if match.group(1):
+            tokens.append(["code", match.group(2)])
+        elif match.group(3) is not None:
+            tokens.append(["link", match.group(3)])
+        else:
+            run = match.group(0)
+            before = line[start - 1] if start > 0 else " "
+            after = line[end] if end < len(line) else " "
+            can_open = not after.isspace()
+            can_close = not before.isspace()
+            if run[0] == "_":
+                # No intraword emphasis for underscores (snake_case stays literal)
+                can_open = can_open and not before.isalnum()
+                can_close = can_close and not after.isalnum()
+            tokens.append(["delim", run[0], len(run), can_open, can_close, len(run), [], []])
+    if pos < len(line):
+        tokens.append(["text", line[pos:]])
+
+    # Pair delimiters. The stack holds the delimiter tokens that may still
+    # open; each match takes 2 characters (bold) when both sides have them,
+    # otherwise 1 (italic), and drops the openers it crossed.
+    stack = []
+    openers_bottom = {}
+    for token in tokens:
+        if token[0] != "delim" or not token[4]:
+            if token[0] == "delim" and token[3]:
+                stack.append(token)
+            continue
+        char, can_open, length = token[1], token[3], token[5]
+        key = (char, can_open, length % 3)
+        while token[2]:
+            position = len(stack) - 1
+            bottom = openers_bottom.get(key, 0)
+            while position >= bottom:
+                opener = stack[position]
+                if opener[1] == char and not (
+                    # CommonMark "rule of 3" for runs that can both open and close
+                    (can_open or opener[4])
+                    and (opener[5] + length) % 3 == 0
+                    and not (opener[5] % 3 == 0 and length % 3 == 0)
+                ):
+                    break
+                position -= 1
+            if position < bottom:
+                openers_bottom[key] = len(stack)
+                break
+            opener = stack[position]
+            size = 2 if opener[2] >= 2 and token[2] >= 2 else 1
+            style = "bold" if size == 2 else "italic"
+            opener[2] -= size
+            token[2] -= size
+            opener[7].append(style)
+            token[6].append(style)
+            height = position + 1 if opener[2] else position
+            del stack[height:]
+            for other in openers_bottom:
+                if openers_bottom[other] > height:
+                    openers_bottom[other] = height
+        if token[2] and can_open:
+            stack.append(token)
+
+    runs = []
+    bold = italic = 0
+    for token in tokens:
+        kind = token[0]
+        if kind == "code":
+            runs.append((token[1], ("code",)))
+            continue
+        if kind == "delim":
+            # A run closes on its left edge and opens on its right edge;
+            # characters left unpaired sit in between as literal text
+            for style in token[6]:
+                if style == "bold":
+                    bold -= 1
+                else:
+                    italic -= 1
+        emphasis = EMPHASIS_TAGS[(bold > 0, italic > 0)]
+        if kind == "text":
+            runs.append((token[1], emphasis))
+        elif kind == "link":
+            runs.append((token[1], emphasis + ("link",)))
+        else:
+            if token[2]:
+                runs.append((token[1] * token[2], emphasis))
+            for style in token[7]:
+                if style == "bold":
+                    bold += 1
+                else:
+                    italic += 1
+    return runs
+
+
+class MarkdownParser:
+    """Turns markdown into a flat list of (text, tags) runs.
+
+    Kept separate from the widget so parsed responses can be cached and
+    re-applied without parsing again. Not thread-safe; MarkdownCache uses
+    a fresh instance for every parse.
+    """
+    def __init__(self):
+        self.runs = []
+
+    def parse(self, text):
+        """Parse markdown text into a list of (text, tags) runs"""
+        self.runs = []
         
         # Process lines
         code_block = False
@@ -62,12 +186,12 @@ class MarkdownText(tk.Text):
             if line.strip().startswith('```'):
                 code_block = not code_block
                 if not code_block:  # End of code block
-                    self.insert(tk.END, '\n')
+                    self.emit('\n')
                 i += 1
                 continue
             
             if code_block:
-                self.insert(tk.END, line + '\n', "code")
+                self.emit(line + '\n', "code")
                 i += 1
                 continue
             
@@ -97,197 +221,718 @@ class MarkdownText(tk.Text):
             
             # Headings
             if line.strip().startswith('# '):
-                self.insert(tk.END, line[2:] + '\n', "heading1")
+                self.emit(line[2:] + '\n', "heading1")
                 i += 1
                 continue
             elif line.strip().startswith('## '):
-                self.insert(tk.END, line[3:] + '\n', "heading2")
+                self.emit(line[3:] + '\n', "heading2")
                 i += 1
                 continue
             elif line.strip().startswith('### '):
-                self.insert(tk.END, line[4:] + '\n', "heading3")
+                self.emit(line[4:] + '\n', "heading3")
                 i += 1
                 continue
             
             # Bullet lists
             if line.strip().startswith('- ') or line.strip().startswith('* '):
                 bullet_list = True
-                self.insert(tk.END, '• ' + line[2:].strip() + '\n', "bullet")
+                self.emit('• ' + line[2:].strip() + '\n', "bullet")
                 i += 1
                 continue
             
             # Process inline formatting
             self.process_inline_markdown(line)
-            self.insert(tk.END, '\n')
+            self.emit('\n')
             bullet_list = False
             i += 1
+        
+        return self.merged_runs()
+    
+    def emit(self, text, tag=None):
+        self.runs.append((text, (tag,) if tag else ()))
+    
+    def merged_runs(self):
+        """Join adjacent runs that share tags so the widget needs fewer inserts"""
+        merged = []
+        parts = []
+        current = None
+        for text, tags in self.runs:
+            if not text:
+                continue
+            if tags != current and parts:
+                merged.append(("".join(parts), current))
+                parts = []
+            current = tags
+            parts.append(text)
+        if parts:
+            merged.append(("".join(parts), current))
+        return tuple(merged)
     
     def process_table(self, table_rows):
-        """Process and render a markdown table with improved formatting"""
-        # Parse table structure
-        rows = []
-        is_header = True
+        """Lay out a markdown table as bordered, tagged runs.
+
+        Each cell is tokenized once; the plain-text length of its runs gives
+        the column widths, and the runs themselves are emitted with the
+        row's tag so bold/italic survive inside cells.
+        """
+        rows = []  # (cells, is_header); a cell is (runs, plain length)
         column_alignments = []
+        is_header = True
         
-        for row_idx, row in enumerate(table_rows):
+        for row in table_rows:
+            stripped = row.strip()
             # Skip empty rows
-            if not row.strip():
+            if not stripped:
                 continue
-                
-            # Check if this is a separator row (|---|---|)
-            if row.strip().replace('|', '').replace('-', '').replace(':', '').strip() == '':
-                # This is a separator row - parse alignments
-                cells = row.strip().split('|')[1:-1]  # Skip first and last empty
-                alignments = []
-                
+            
+            cells = stripped.split('|')[1:-1]  # Skip the first and last empty cells
+            
+            # Separator row (|---|:---:|) sets the column alignments
+            if not stripped.replace('|', '').replace('-', '').replace(':', '').strip():
+                column_alignments = []
                 for cell in cells:
                     cell = cell.strip()
                     if cell.startswith(':') and cell.endswith(':'):
-                        alignments = 'center'
-                    elif cell.startswith(':'):
-                        alignments = 'left'
+                        column_alignments.append('center')
                     elif cell.endswith(':'):
-                        alignments = 'right'
+                        column_alignments.append('right')
                     else:
-                        alignments = 'left'  # Default alignment
-                    column_alignments.append(alignments)
-                    
+                        column_alignments.append('left')
                 is_header = False
                 continue
-                
-            # Process cells in the row
-            cells = []
-            for cell in row.strip().split('|')[1:-1]:  # Skip the first and last empty cells
-                # Process any markdown in the cell
-                cells.append(cell.strip())
             
-            rows.append((cells, is_header))
+            parsed = []
+            for cell in cells:
+                runs = tokenize_inline(cell.strip())
+                parsed.append((runs, sum(len(text) for text, _ in runs)))
+            rows.append((parsed, is_header))
             is_header = False
         
         if not rows:
             return
         
-        # Calculate column widths based on content
-        col_count = max(len(row[0]) for row in rows)
-        col_widths = [0] * col_count
-        
-        for row, _ in rows:
-            for i, cell in enumerate(row):
-                if i < col_count:
-                    # Account for markdown characters in width calculation
-                    clean_cell = re.sub(r'\*\*(.*?)\*\*', r'\1', cell)  # Remove bold
-                    clean_cell = re.sub(r'\*(.*?)\*', r'\1', clean_cell)  # Remove italic
-                    col_widths[i] = max(col_widths[i], len(clean_cell))
-        
-        # Set minimum column width
+        # Column widths in one pass over the measured cells
+        col_count = max(len(cells) for cells, _ in rows)
         min_col_width = 8
-        col_widths = [max(w, min_col_width) for w in col_widths]
+        col_widths = [min_col_width] * col_count
+        for cells, _ in rows:
+            for i, (_, length) in enumerate(cells):
+                if length > col_widths[i]:
+                    col_widths[i] = length
         
-        # Render table with borders
-        self.insert(tk.END, "\n")
+        def border(left, middle, right):
+            return left + middle.join("─" * (width + 2) for width in col_widths) + right + "\n"
         
-        # Render top border
-        top_border = "┌"
-        for i, width in enumerate(col_widths):
-            top_border += "─" * (width + 2)
-            if i < len(col_widths) - 1:
-                top_border += "┬"
-        top_border += "┐\n"
-        self.insert(tk.END, top_border, "table_border")
+        runs = self.runs
+        runs.append(("\n", ()))
+        runs.append((border("┌", "┬", "┐"), ("table_border",)))
         
-        # Render rows
         for row_idx, (cells, is_header) in enumerate(rows):
-            row_text = "│"
+            if is_header:
+                row_tag = "table_header"
+            else:
+                row_tag = "table_row_even" if row_idx % 2 == 0 else "table_row_odd"
             
-            for i, cell in enumerate(cells):
-                if i >= col_count:
-                    continue
-                    
-                # Clean cell content from markdown for alignment
-                clean_cell = re.sub(r'\*\*(.*?)\*\*', r'\1', cell)
-                clean_cell = re.sub(r'\*(.*?)\*', r'\1', clean_cell)
-                
-                # Apply alignment
+            runs.append(("│", (row_tag,)))
+            for i in range(col_count):
+                cell_runs, length = cells[i] if i < len(cells) else ((), 0)
+                gap = col_widths[i] - length
                 alignment = column_alignments[i] if i < len(column_alignments) else 'left'
-                cell_width = col_widths[i]
-                
-                if alignment == 'left':
-                    padded_cell = clean_cell.ljust(cell_width)
-                elif alignment == 'right':
-                    padded_cell = clean_cell.rjust(cell_width)
-                else:  # center
-                    padded_cell = clean_cell.center(cell_width)
-                
-                # Restore markdown formatting
-                formatted_cell = cell.replace(clean_cell, padded_cell)
+                if alignment == 'right':
+                    left_pad = gap
+                elif alignment == 'center':
+                    left_pad = gap // 2
+                else:
+                    left_pad = 0
                 
-                # Add cell to row
-                row_text += " " + formatted_cell + " │"
+                runs.append((" " * (left_pad + 1), (row_tag,)))
+                for text, tags in cell_runs:
+                    runs.append((text, (row_tag,) + tags))
+                runs.append((" " * (gap - left_pad + 1) + "│", (row_tag,)))
+            runs.append(("\n", (row_tag,)))
             
-            # Insert the row with appropriate tag
             if is_header:
-                self.insert(tk.END, row_text + "\n", "table_header")
-                
-                # Add header separator
-                sep_row = "├"
-                for i, width in enumerate(col_widths):
-                    sep_row += "─" * (width + 2)
-                    if i < len(col_widths) - 1:
-                        sep_row += "┼"
-                sep_row += "┤\n"
-                self.insert(tk.END, sep_row, "table_border")
-            else:
-                tag = "table_row_even" if row_idx % 2 == 0 else "table_row_odd"
-                self.insert(tk.END, row_text + "\n", tag) 
-        # Render bottom border
-        bottom_border = "└"
-        for i, width in enumerate(col_widths):
-            bottom_border += "─" * (width + 2)
-            if i < len(col_widths) - 1:
-                bottom_border += "┴"
-        bottom_border += "┘\n"
-        self.insert(tk.END, bottom_border, "table_border")
+                runs.append((border("├", "┼", "┤"), ("table_border",)))
         
-        self.insert(tk.END, "\n")
+        runs.append((border("└", "┴", "┘"), ("table_border",)))
+        runs.append(("\n", ()))
+    
+    def process_inline_markdown(self, line):
+        """Emit runs for inline markdown elements like bold, italic, code and links"""
+        self.runs.extend(tokenize_inline(line))
+
+
+class MarkdownCache:
+    """LRU cache of parsed runs keyed by a hash of the markdown source"""
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_runs(self, text):
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            runs = self._entries.get(key)
+            if runs is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return runs
+            self.misses += 1
+        runs = MarkdownParser().parse(text)
+        with self._lock:
+            self._entries[key] = runs
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return runs
+
+
+markdown_cache = MarkdownCache()
+
+
+class MarkdownText(tk.Text):
+    """A Text widget with improved Markdown rendering capabilities"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tag_configure("bold", font=("Courier", 10, "bold"))
+        self.tag_configure("italic", font=("Courier", 10, "italic"))
+        self.tag_configure("bold_italic", font=("Courier", 10, "bold italic"))
+        self.tag_configure("heading1", font=("Courier", 14, "bold"))
+        self.tag_configure("heading2", font=("Courier", 12, "bold"))
+        self.tag_configure("heading3", font=("Courier", 11, "bold"))
+        self.tag_configure("code", background="#f0f0f0", font=("Courier", 9))
+        self.tag_configure("bullet", lmargin1=20, lmargin2=30)
+        self.tag_configure("link", foreground="blue", underline=1)
+
+        # Table styling with background colors
+        self.tag_configure("table_border", foreground="#555555")
+        self.tag_configure("table_header", 
+                        font=("Courier", 10, "bold"), 
+                        foreground="#000000",
+                        background="#e1e5eb")  # Light gray background for header
+        self.tag_configure("table_row_even", 
+                        foreground="#333333",
+                        background="#f5f7fa")  # Very light gray for even rows
+        self.tag_configure("table_row_odd", 
+                        foreground="#333333",
+                        background="#ffffff")  # White for odd rows
+
+    def insert_markdown(self, text):
+        """Parse (or fetch from cache) and insert markdown text"""
+        # Clear current content
+        self.delete(1.0, tk.END)
+        self.apply_runs(markdown_cache.get_runs(text))
+
+    def apply_runs(self, runs, batch_size=500):
+        """Insert runs with as few Text.insert calls as possible"""
+        for start in range(0, len(runs), batch_size):
+            args = []
+            for text, tags in runs[start:start + batch_size]:
+                args.append(text)
+                args.append(tags)
+            self.insert(tk.END, *args)
+
+
+class IncrementalMarkdown:
+    """Renders a growing markdown document into a MarkdownText.
+
+    Everything up to the last blank line outside a code fence is a
+    completed block: it is parsed and inserted once and never touched
+    again. Only the trailing, still-open block is deleted (from the
+    "stream_tail" mark) and re-rendered each time more text arrives.
+    """
+    def __init__(self, widget):
+        self.widget = widget
+        self.text = ""
+        self.stable_len = 0  # chars of text already rendered as completed blocks
+        widget.config(state=tk.NORMAL)
+        widget.delete(1.0, tk.END)
+        widget.mark_set("stream_tail", "end-1c")
+        widget.mark_gravity("stream_tail", tk.LEFT)
+        widget.config(state=tk.DISABLED)
+
+    def _stable_boundary(self):
+        """(end of completed text, start of the open block)"""
+        text = self.text
+        pos = self.stable_len
+        in_fence = False
+        boundary = next_start = self.stable_len
+        while True:
+            newline = text.find("\n", pos)
+            if newline < 0:
+                break  # the last line is still being written
+            stripped = text[pos:newline].strip()
+            if stripped.startswith("```"):
+                in_fence = not in_fence
+            elif not stripped and not in_fence:
+                boundary, next_start = newline, newline + 1
+            pos = newline + 1
+        return boundary, next_start
+
+    def update(self, text, final=False):
+        """Render text, which must extend what was rendered before"""
+        self.text = text
+        if final:
+            boundary = next_start = len(text)
+        else:
+            boundary, next_start = self._stable_boundary()
+
+        widget = self.widget
+        widget.config(state=tk.NORMAL)
+        widget.delete("stream_tail", tk.END)
+        if next_start > self.stable_len:
+            widget.apply_runs(MarkdownParser().parse(text[self.stable_len:boundary]))
+            self.stable_len = next_start
+            widget.mark_set("stream_tail", "end-1c")
+        if self.stable_len < len(text):
+            widget.apply_runs(MarkdownParser().parse(text[self.stable_len:]))
+        widget.config(state=tk.DISABLED)
+
+
+class ScreenshotCard:
+    """A recyclable card widget: API response, thumbnail and title bar.
+
+    Widgets are built once; bind() swaps in the content of another capture
+    so the list can reuse cards as the user scrolls.
+    """
+    def __init__(self, app, parent):
+        self.app = app
+        self.data = None
+        self.photo = None
+        self.stream_renderer = None
+
+        self.frame = ttk.Frame(parent)
+
+        # --- API Response Card ---
+        response_card = ttk.Frame(self.frame, relief="solid", borderwidth=1, padding=10)
+        response_card.pack(fill=tk.X, padx=5, pady=5)
+
+        # --- Scrollable Text Container ---
+        text_frame = ttk.Frame(response_card)
+        text_frame.pack(fill=tk.BOTH, expand=True)
+
+        # --- Scrollbars ---
+        v_scrollbar = ttk.Scrollbar(text_frame, orient="vertical")
+
+        # --- Response Content with Markdown Formatting ---
+        self.response_content = MarkdownText(
+            text_frame,
+            wrap=tk.WORD,  # Wrap words to avoid horizontal scrolling unless necessary
+            height=20,  # Default height
+            width=70,
+            font=("Segoe UI", 10),
+            bg="#DBEAF7",
+            relief=tk.FLAT,
+            padx=10,
+            pady=5,
+            yscrollcommand=v_scrollbar.set,
+        )
+        v_scrollbar.config(command=self.response_content.yview)
+
+        self.response_content.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
+        v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        # --- Screenshot Below ---
+        self.image_frame = ttk.Frame(self.frame, borderwidth=1, relief="solid")
+        self.image_label = ttk.Label(self.image_frame)
+        self.image_label.pack()
+
+        # --- Header for Open Button ---
+        self.title_frame = ttk.Frame(self.frame)
+        self.title_frame.pack(fill=tk.X)
+
+        self.title_label = ttk.Label(
+            self.title_frame,
+            font=("Arial", 10, "bold"),
+            foreground=app.colors["primary"]
+        )
+        self.title_label.pack(side=tk.LEFT, pady=5)
+
+        open_button = ttk.Button(
+            self.title_frame,
+            text="Open Image",
+            command=self.open_image,
+        )
+        open_button.pack(side=tk.RIGHT, padx=5)
+
+    def bind(self, screenshot_data):
+        """Show the given capture in this card"""
+        self.data = screenshot_data
+
+        if screenshot_data.get("streaming"):
+            self.stream_renderer = IncrementalMarkdown(self.response_content)
+            self.stream_renderer.update(screenshot_data.get("api_response") or "")
+        else:
+            self.stream_renderer = None
+            response_text = screenshot_data.get("api_response") or "No API response available"
+            self.response_content.config(state=tk.NORMAL)
+            self.response_content.insert_markdown(response_text)
+            self.response_content.config(state=tk.DISABLED)  # Make it read-only
+        self.response_content.yview_moveto(0)
+
+        self.show_thumbnail(self.app.get_thumbnail(screenshot_data))
+
+        self.title_label.configure(
+            text=f"{screenshot_data['title']} - {screenshot_data['timestamp']}"
+        )
+
+    def show_thumbnail(self, thumbnail):
+        """Show a thumbnail, or hide the image area while it is still loading"""
+        if thumbnail is not None:
+            self.photo = ImageTk.PhotoImage(thumbnail)
+            self.image_label.configure(image=self.photo)
+            self.image_frame.pack(pady=5, before=self.title_frame)
+        else:
+            self.photo = None
+            self.image_label.configure(image="")
+            self.image_frame.pack_forget()
+
+    def update_stream(self):
+        """Render newly streamed response text"""
+        if self.stream_renderer is None:
+            return
+        streaming = self.data.get("streaming")
+        self.stream_renderer.update(self.data.get("api_response") or "", final=not streaming)
+        if not streaming:
+            self.stream_renderer = None
+
+    def release(self):
+        """Drop references to the bound capture so its image can be freed"""
+        self.data = None
+        self.stream_renderer = None
+        self.photo = None
+        self.image_label.configure(image="")
+
+    def open_image(self):
+        if self.data is not None:
+            self.app.open_screenshot(self.app.capture_store.image_path(self.data))
+
+
+class ScreenshotListView:
+    """Virtualized view of the screenshot history on a Canvas.
+
+    Only cards inside the visible scroll region (plus one screen of
+    overscan above and below) are materialized. Each card is a canvas
+    window positioned at the item's y offset; cards that scroll out of
+    range go back to a small pool and are rebound to other captures, so
+    the widget count stays bounded by the viewport, not the session length.
+    """
+    OVERSCAN = 1.0      # viewport heights materialized above and below
+    CARD_SPACING = 15
+    MAX_POOL = 4        # idle cards kept around for reuse
+    PARKED_Y = -100000  # where idle cards are moved out of sight
+
+    def __init__(self, canvas, card_factory, estimated_height=520):
+        self.canvas = canvas
+        self.card_factory = card_factory
+        self.estimated_height = estimated_height
+        self.items = []         # capture dicts, newest first
+        self.heights = {}       # capture id -> measured card height
+        self.offsets = [0]      # y offset of each item, plus total height
+        self.live = {}          # capture id -> (card, canvas window id)
+        self.pool = []          # idle (card, canvas window id) pairs
+        self.width = 1
+        self._refresh_pending = False
+
+    # --- Model updates ---
+    def prepend(self, screenshot_data):
+        """Insert a new capture at the top, keeping the visible cards in place"""
+        top = self.canvas.canvasy(0)
+        self.items.insert(0, screenshot_data)
+        self._relayout()
+        if top > 0:
+            # Keep the user's scroll position anchored on what they were reading
+            self._scroll_to(top + self._height_of(screenshot_data))
+        self.refresh()
+
+    def append(self, screenshot_data):
+        """Add a capture below all existing ones (used when loading history)"""
+        self.items.append(screenshot_data)
+        self._relayout()
+        self.schedule_refresh()
+
+    def clear(self):
+        for capture_id in list(self.live):
+            self._release(capture_id)
+        self.items = []
+        self.heights.clear()
+        self._relayout()
+
+    def __len__(self):
+        return len(self.items)
+
+    def remeasure(self, capture_id):
+        """Measure a card again after its content changed height"""
+        if self.heights.pop(capture_id, None) is not None:
+            self.schedule_refresh()
+
+    def card_for(self, capture_id):
+        """The live card showing a capture, or None if it is not materialized"""
+        entry = self.live.get(capture_id)
+        return entry[0] if entry else None
+
+    # --- Geometry ---
+    def set_width(self, width):
+        self.width = max(width, 1)
+        for card, window_id in list(self.live.values()) + self.pool:
+            self.canvas.itemconfigure(window_id, width=self.width)
+        self._relayout()
+        self.schedule_refresh()
+
+    def _height_of(self, item):
+        return self.heights.get(item["id"], self.estimated_height)
+
+    def _relayout(self):
+        offsets = [0]
+        for item in self.items:
+            offsets.append(offsets[-1] + self._height_of(item))
+        self.offsets = offsets
+        self.canvas.configure(scrollregion=(0, 0, self.width, max(offsets[-1], 1)))
+
+    def _scroll_to(self, y):
+        total = self.offsets[-1]
+        if total > 0:
+            self.canvas.yview_moveto(y / total)
+
+    # --- Materialization ---
+    def schedule_refresh(self):
+        """Coalesce refresh requests from scroll and configure events"""
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            self.canvas.after_idle(self.refresh)
+
+    def visible_range(self):
+        top = self.canvas.canvasy(0)
+        view_height = max(self.canvas.winfo_height(), 1)
+        margin = view_height * self.OVERSCAN
+        first = max(bisect.bisect_right(self.offsets, top - margin) - 1, 0)
+        last = min(bisect.bisect_left(self.offsets, top + view_height + margin), len(self.items))
+        return first, last
+
+    def refresh(self):
+        self._refresh_pending = False
+        first, last = self.visible_range()
+        wanted = {item["id"] for item in self.items[first:last]}
+
+        for capture_id in list(self.live):
+            if capture_id not in wanted:
+                self._release(capture_id)
+
+        measured = False
+        for index in range(first, last):
+            item = self.items[index]
+            if item["id"] not in self.live:
+                card, window_id = self._acquire()
+                card.bind(item)
+                self.live[item["id"]] = (card, window_id)
+            card, window_id = self.live[item["id"]]
+            self.canvas.coords(window_id, 0, self.offsets[index])
+
+            if item["id"] not in self.heights:
+                card.frame.update_idletasks()
+                self.heights[item["id"]] = card.frame.winfo_reqheight() + self.CARD_SPACING
+                measured = True
+
+        if measured:
+            # Real heights replace estimates; reposition once with the new offsets
+            self._relayout()
+            for index in range(first, last):
+                card, window_id = self.live[self.items[index]["id"]]
+                self.canvas.coords(window_id, 0, self.offsets[index])
+
+    def _acquire(self):
+        if self.pool:
+            return self.pool.pop()
+        card = self.card_factory(self.canvas)
+        window_id = self.canvas.create_window(
+            (0, self.PARKED_Y), window=card.frame, anchor=tk.NW, width=self.width
+        )
+        return card, window_id
+
+    def _release(self, capture_id):
+        entry = self.live.pop(capture_id, None)
+        if entry is None:
+            return
+        card, window_id = entry
+        card.release()
+        if len(self.pool) < self.MAX_POOL:
+            self.canvas.coords(window_id, 0, self.PARKED_Y)
+            self.pool.append(entry)
+        else:
+            self.canvas.delete(window_id)
+            card.frame.destroy()
+
+
+class UiDispatcher:
+    """Runs UI mutations posted from worker threads on the Tk main loop.
+
+    Workers call post() instead of touching widgets. A periodic after()
+    tick drains the queue on the main thread, spending at most budget_ms
+    and max_per_tick callbacks per tick so a burst of finished captures
+    cannot stall redraws. Posts that share a key are coalesced: only the
+    latest arguments run, in the queue position of the first post.
+    """
+    def __init__(self, root, interval_ms=16, budget_ms=8, max_per_tick=50):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.budget_ms = budget_ms
+        self.max_per_tick = max_per_tick
+        self._queue = deque()  # (key, fn, args); fn is None for keyed entries
+        self._keyed = {}  # key -> (fn, args) awaiting their queue slot
+        self._lock = threading.Lock()
+        self._main_thread = threading.current_thread()
+        self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def post(self, fn, *args, key=None):
+        """Schedule fn(*args) on the main thread"""
+        with self._lock:
+            if key is None:
+                self._queue.append((None, fn, args))
+            elif key in self._keyed:
+                self._keyed[key] = (fn, args)
+            else:
+                self._keyed[key] = (fn, args)
+                self._queue.append((key, None, None))
+
+    def call(self, fn, *args, timeout=None):
+        """Run fn(*args) on the main thread and wait for its result"""
+        if threading.current_thread() is self._main_thread:
+            return fn(*args)
+
+        done = threading.Event()
+        outcome = {}
+
+        def run():
+            try:
+                outcome["result"] = fn(*args)
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                done.set()
+
+        self.post(run)
+        if not done.wait(timeout):
+            raise TimeoutError(f"UI call {getattr(fn, '__name__', fn)} timed out")
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome.get("result")
+
+    def _tick(self):
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        handled = 0
+        while handled < self.max_per_tick and time.perf_counter() < deadline:
+            with self._lock:
+                if not self._queue:
+                    break
+                key, fn, args = self._queue.popleft()
+                if key is not None:
+                    fn, args = self._keyed.pop(key)
+            try:
+                fn(*args)
+            except Exception as e:
+                print("Error in UI callback:", str(e))
+            handled += 1
+        self._after_id = self.root.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+
+
+class CaptureStore:
+    """Capture history with a bounded RAM budget.
+
+    Metadata always stays resident; thumbnails belong to the processor's
+    ThumbnailCache LRU and are never kept on entries. The heavy fields of
+    an entry (the full-resolution "image" and the ChatPayload in
+    "payload_json") are tracked in LRU order and dropped once the budget is
+    exceeded. The full image already lives at entry["path"], and the payload
+    was sent and journaled, so neither needs to be kept.
+    """
+    HEAVY_FIELDS = ("image", "payload_json")
+
+    def __init__(self, ram_budget_bytes=256 * 1024 * 1024):
+        self.ram_budget_bytes = ram_budget_bytes
+        self.entries = []  # newest first
+        self._resident = OrderedDict()  # capture id -> heavy bytes, oldest first
+        self._by_id = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def image_bytes(image):
+        if image is None:
+            return 0
+        width, height = image.size
+        return width * height * len(image.getbands())
+
+    def _heavy_bytes(self, entry):
+        size = self.image_bytes(entry.get("image"))
+        payload = entry.get("payload_json")
+        if payload is not None:
+            size += sum(len(img) for img in payload.images)
+        return size
+
+    def add(self, entry):
+        """Add a capture at the top of the history and enforce the budget"""
+        with self._lock:
+            self.entries.insert(0, entry)
+            self._by_id[entry["id"]] = entry
+            self._touch(entry)
+            self._enforce_budget()
+        return entry
+
+    def get(self, capture_id):
+        return self._by_id.get(capture_id)
+
+    def _touch(self, entry):
+        self._resident[entry["id"]] = self._heavy_bytes(entry)
+        self._resident.move_to_end(entry["id"])
+
+    def _enforce_budget(self):
+        total = sum(self._resident.values())
+        while total > self.ram_budget_bytes and len(self._resident) > 1:
+            capture_id, size = self._resident.popitem(last=False)
+            self._evict(self._by_id[capture_id])
+            total -= size
+
+    def _evict(self, entry):
+        if entry.get("image") is not None and not os.path.exists(entry["path"]):
+            entry["image"].save(entry["path"])
+        for field in self.HEAVY_FIELDS:
+            entry[field] = None
+
+    def image_path(self, entry):
+        """Path of the full-resolution file, writing it out if it went missing"""
+        with self._lock:
+            if not os.path.exists(entry["path"]) and entry.get("image") is not None:
+                entry["image"].save(entry["path"])
+            return entry["path"]
+
+    def memory_usage(self):
+        """Approximate resident bytes for the whole history"""
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "resident_full": sum(1 for e in self.entries if e.get("image") is not None),
+                "heavy_bytes": sum(self._resident.values()),
+                "budget_bytes": self.ram_budget_bytes,
+            }
+
+    def describe_memory(self):
+        usage = self.memory_usage()
+        mb = 1024 * 1024
+        return (f"{usage['heavy_bytes'] / mb:.1f}/{usage['budget_bytes'] / mb:.0f} MB full images, "
+                f"{usage['resident_full']}/{usage['entries']} resident")
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._by_id.clear()
+            self._resident.clear()
 
 
-    def process_inline_markdown(self, line):
-        """Process inline markdown elements like bold, italic, and links"""
-        line_remaining = line
-        
-        while line_remaining:
-            # Find the first occurrence of each pattern
-            bold_match = re.search(r'\*\*(.*?)\*\*', line_remaining)
-            italic_match = re.search(r'\*(.*?)\*', line_remaining)
-            link_match = re.search(r'\[(.*?)\]\((.*?)\)', line_remaining)
-            
-            # Determine which pattern comes first, if any
-            matches = []
-            if bold_match:
-                matches.append(('bold', bold_match.start(), bold_match.end(), bold_match.group(1)))
-            if italic_match:
-                matches.append(('italic', italic_match.start(), italic_match.end(), italic_match.group(1)))
-            if link_match:
-                matches.append(('link', link_match.start(), link_match.end(), link_match.group(1)))
-            
-            # If no matches, insert remaining text and exit
-            if not matches:
-                self.insert(tk.END, line_remaining)
-                break
-            
-            # Sort matches by start position
-            matches.sort(key=lambda x: x[1])
-            match_type, start, end, content = matches[0]
-            
-            # Insert text before the match
-            if start > 0:
-                self.insert(tk.END, line_remaining[:start])
-            
-            # Insert matched content with appropriate tag
-            self.insert(tk.END, content, match_type)
-            
-            # Update remaining line
-            line_remaining = line_remaining[end:]
 class ScreenshotApp:
     def __init__(self, root):
         
@@ -297,7 +942,7 @@ class ScreenshotApp:
         self.root.resizable(True, True)
 
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
-        self.payload_file = os.path.join(self.script_dir, "payload.json")
+        self.settings = self.load_settings()
 
         # Define color scheme for a more colorful UI
         self.colors = {
@@ -318,21 +963,76 @@ class ScreenshotApp:
         
         self.root.configure(bg=self.colors["bg_light"])
         
-        self.screenshots = []
         self.is_capturing = False
         self.drag_started = False  # To track if we're dragging
         self.status_message = ""
         self.status_type = "info"
         
-        self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.temp_dir = os.path.join(tempfile.gettempdir(), f"es_screenshots_{self.timestamp}")
-        os.makedirs(self.temp_dir, exist_ok=True)
+        # Temp directories left by earlier versions' sessions are trimmed in the background
+        self.storage = TempStorageManager(
+            tempfile.gettempdir(),
+            max_bytes=int(self.settings["temp_max_mb"] * 1024 * 1024),
+            max_age=self.settings["temp_max_age_hours"] * 3600,
+            interval=self.settings["temp_cleanup_interval"],
+            on_cleanup=self.on_temp_cleanup
+        )
+
+        self.processor = CaptureProcessor(
+            self.settings,
+            self.script_dir,
+            stream_handler=self.stream_api_response,
+            on_error=self.on_journal_error,
+            on_cleanup=self.on_archive_cleanup
+        )
+
+        self.ui = UiDispatcher(self.root)
+        # Cleanup reports through the dispatcher, so start only once it exists
+        self.storage.start()
+        self.processor.storage.start()
+
+        self.pipeline = CapturePipeline(
+            self.processor.process_item,
+            self.on_capture_processed,
+            workers=self.settings["pipeline_workers"],
+            max_pending=self.settings["pipeline_max_pending"]
+        )
+
+        # Batch mode: collect batch_size captures (or batch_window seconds' worth) per request
+        self.batcher = None
+        if self.settings["batch_size"] > 1:
+            self.batcher = CaptureBatcher(
+                self.submit_batch,
+                max_items=self.settings["batch_size"],
+                max_wait=self.settings["batch_window"]
+            )
+
+        self.capture_store = CaptureStore(
+            ram_budget_bytes=int(self.settings["ram_budget_mb"] * 1024 * 1024)
+        )
+        self.screenshots = self.capture_store.entries
         
         self.create_main_layout()
         self.create_floating_button()
+        self.load_history()
+
+        # Find out once which window-info and grab strategies work here
+        self.backends = default_backends()
+        threading.Thread(target=self.probe_backends, daemon=True).start()
+
+        # Hide handshake and grab latency, see wait_for_app_hidden
+        self.app_hidden = threading.Event()
+        self.pending_unmap = set()
+        self.hide_stats = LatencyStats()
+        self.grab_stats = LatencyStats()
+        self.root.bind("<Unmap>", self.on_app_unmap, add="+")
+        self.button_window.bind("<Unmap>", self.on_app_unmap, add="+")
         
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+    def load_settings(self):
+        """Load settings.json from the script directory over the defaults"""
+        return load_settings(os.path.join(self.script_dir, "settings.json"))
+
     def configure_styles(self):
         style = ttk.Style()
         style.theme_use('clam')  # Use clam theme as base
@@ -366,14 +1066,8 @@ class ScreenshotApp:
                         background=self.colors["bg_light"],
                         foreground=self.colors["primary"])
 
-    def save_payload_to_file(self, payload):
-        """Save the payload to a JSON file in the script directory"""
-        try:
-            with open(self.payload_file, 'w') as f:
-                json.dump(payload, f, indent=2)
-            self.update_status(f"Payload saved to {self.payload_file}", "success")
-        except Exception as e:
-            self.update_status(f"Error saving payload: {str(e)}", "error")
+    def on_journal_error(self, error):
+        self.post_status(f"Error saving payload: {str(error)}", "error")
 
     def setup_icon(self):
         try:
@@ -412,35 +1106,41 @@ class ScreenshotApp:
         
         self.canvas = tk.Canvas(screenshots_frame, bg="#F8DF7C")
         self.scrollbar = ttk.Scrollbar(screenshots_frame, orient=tk.VERTICAL, command=self.canvas.yview)
-        self.canvas.configure(yscrollcommand=self.scrollbar.set)
+        self.canvas.configure(yscrollcommand=self.on_yscroll)
         
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
-        self.screenshots_container = ttk.Frame(self.canvas)
-        self.screenshots_container_id = self.canvas.create_window(
-            (0, 0), 
-            window=self.screenshots_container, 
-            anchor=tk.NW
-        )
-        
         self.canvas.bind("<Configure>", self.on_canvas_configure)
-        self.screenshots_container.bind("<Configure>", self.on_frame_configure)
 
         # Bind mouse wheel scrolling
         self.canvas.bind_all("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind_all("<Button-4>", self.on_mouse_wheel)
+        self.canvas.bind_all("<Button-5>", self.on_mouse_wheel)
+
+        self.screenshot_list = ScreenshotListView(
+            self.canvas,
+            lambda parent: ScreenshotCard(self, parent)
+        )
 
     def on_canvas_configure(self, event):
-        """Adjust the canvas width to match the container"""
-        self.canvas.itemconfig(self.screenshots_container_id, width=event.width)
+        """Adjust the card width to match the canvas"""
+        self.screenshot_list.set_width(event.width)
 
-    def on_frame_configure(self, event):
-        """Update the scroll region to encompass the entire frame"""
-        self.canvas.configure(scrollregion=self.canvas.bbox("all"))
+    def on_yscroll(self, first, last):
+        """Keep the scrollbar in sync and materialize cards for the new view"""
+        self.scrollbar.set(first, last)
+        self.screenshot_list.schedule_refresh()
 
     def on_mouse_wheel(self, event):
         """Scroll the canvas vertically when the mouse wheel is used"""
-        self.canvas.yview_scroll(-1 * (event.delta // 120), "units")
+        if event.num == 4:
+            delta = -1
+        elif event.num == 5:
+            delta = 1
+        else:
+            delta = -1 * (event.delta // 120)
+        self.canvas.yview_scroll(delta, "units")
 
     def create_floating_button(self):
         self.button_window = tk.Toplevel(self.root)
@@ -605,265 +1305,190 @@ class ScreenshotApp:
         capture_thread.daemon = True
         capture_thread.start()
     
-    def get_window_info(self):
-        system = platform.system()
-        
-        if system == 'Windows':
-            try:
-                import ctypes
-                from ctypes.wintypes import RECT
-                
-                user32 = ctypes.windll.user32
-                foreground_window = user32.GetForegroundWindow()
-                
-                length = user32.GetWindowTextLengthW(foreground_window)
-                buff = ctypes.create_unicode_buffer(length + 1)
-                user32.GetWindowTextW(foreground_window, buff, length + 1)
-                title = buff.value
-                
-                rect = RECT()
-                user32.GetWindowRect(foreground_window, ctypes.byref(rect))
-                bounds = (rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top)
-                
-                return title, bounds
-            except Exception as e:
-                return f"Window_{datetime.now().strftime('%H%M%S')}", None
-        
-        elif system == 'Darwin':  # macOS
-            try:
-                import subprocess
-                
-                title_cmd = """osascript -e 'tell application "System Events" to get name of first process whose frontmost is true'"""
-                title = subprocess.check_output(title_cmd, shell=True).decode('utf-8').strip()
-                
-                bounds_script = """
-                osascript -e '
-                tell application "System Events"
-                    set frontApp to first application process whose frontmost is true
-                    set frontAppName to name of frontApp
-                    tell process frontAppName
-                        set appWindow to first window
-                        set {x, y} to position of appWindow
-                        set {width, height} to size of appWindow
-                        return x & "," & y & "," & width & "," & height
-                    end tell
-                end tell
-                '
-                """
-                
-                result = subprocess.check_output(bounds_script, shell=True).decode('utf-8').strip()
-                bounds = [int(val) for val in result.split(',')]
-                return title, tuple(bounds)
-            except Exception as e:
-                return f"Window_{datetime.now().strftime('%H%M%S')}", None
-        
-        elif system == 'Linux':
-            try:
-                import subprocess
-                
-                win_id_cmd = ["xdotool", "getactivewindow"]
-                win_id = subprocess.check_output(win_id_cmd).decode('utf-8').strip()
-                
-                name_cmd = ["xdotool", "getwindowname", win_id]
-                title = subprocess.check_output(name_cmd).decode('utf-8').strip()
-                
-                geo_cmd = ["xdotool", "getwindowgeometry", win_id]
-                geo_output = subprocess.check_output(geo_cmd).decode('utf-8')
-                
-                pos_line = [line for line in geo_output.split('\n') if "Position" in line][0]
-                pos_parts = pos_line.split(":")[1].strip().split(",")
-                x = int(pos_parts[0])
-                y = int(pos_parts[1])
-                
-                size_line = [line for line in geo_output.split('\n') if "Geometry" in line][0]
-                size_parts = size_line.split(":")[1].strip().split("x")
-                width = int(size_parts[0])
-                height = int(size_parts[1])
-                
-                return title, (x, y, width, height)
-            except Exception as e:
-                return f"Window_{datetime.now().strftime('%H%M%S')}", None
-        
-        return f"Window_{datetime.now().strftime('%H%M%S')}", None
+    def probe_backends(self):
+        """Startup capability probe (runs on a background thread)"""
+        self.backends.probe()
+        self.post_status(f"Ready to capture screenshots. Backends: {self.backends.describe()}", "info")
+        print("Backend probe:", json.dumps(self.backends.metrics()["probe"]))
     
     def capture_active_window(self):
+        """Grab the active window and queue it for processing"""
         self.is_capturing = True
-        self.show_loader()  # Show loader centered on the screen
+
+        grab_start = time.perf_counter()
 
         try:
-            self.root.withdraw()
-            self.button_window.withdraw()
-            
-            time.sleep(0.5)
+            self.ui.call(self.hide_app_windows, timeout=5)
             
-            window_title, window_bounds = self.get_window_info()
+            # Wait only as long as it takes for our windows to disappear
+            self.wait_for_app_hidden()
             
-            if "Taro " in window_title or not window_title:
-                self.root.deiconify()
-                self.button_window.deiconify()
-                self.update_status("No active window detected or captured our own app", "info")
-                self.is_capturing = False
-                self.hide_loader()  # Hide loader on failure
+            # Same grab and frame-diff path as the headless runner
+            capture, skipped = self.processor.grab(self.backends, exclude_title="Taro ")
+            self.ui.post(self.show_app_windows)
+            if capture is None:
+                self.post_status(skipped, "info")
                 return
+            self.grab_stats.record((time.perf_counter() - grab_start) * 1000)
+            window_title = capture["title"]
+            capture_type = capture["capture_type"]
             
-            # Take high-resolution screenshot
-            if window_bounds:
-                x, y, width, height = window_bounds
-                
-                if width <= 0 or height <= 0:
-                    self.root.deiconify()
-                    self.button_window.deiconify()
-                    self.update_status("Invalid window dimensions detected", "error")
-                    self.is_capturing = False
-                    self.hide_loader()  # Hide loader on failure
-                    return
-                
-                screenshot = pyautogui.screenshot(region=(x, y, width, height))
-                capture_type = "active window"
-            else:
-                if platform.system() == 'Windows':
-                    try:
-                        import win32gui
-                        import win32ui
-                        from ctypes import windll
-                        from PIL import Image
-                        
-                        hwnd = win32gui.GetForegroundWindow()
-                        
-                        left, top, right, bottom = win32gui.GetWindowRect(hwnd)
-                        width = right - left
-                        height = bottom - top
-                        
-                        hwndDC = win32gui.GetWindowDC(hwnd)
-                        mfcDC = win32ui.CreateDCFromHandle(hwndDC)
-                        saveDC = mfcDC.CreateCompatibleDC()
-                        
-                        saveBitMap = win32ui.CreateBitmap()
-                        saveBitMap.CreateCompatibleBitmap(mfcDC, width, height)
-                        
-                        saveDC.SelectObject(saveBitMap)
-                        
-                        result = windll.user32.PrintWindow(hwnd, saveDC.GetSafeHdc(), 0)
-                        
-                        bmpinfo = saveBitMap.GetInfo()
-                        bmpstr = saveBitMap.GetBitmapBits(True)
-                        screenshot = Image.frombuffer(
-                            'RGB',
-                            (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
-                            bmpstr, 'raw', 'BGRX', 0, 1)
-                        
-                        win32gui.DeleteObject(saveBitMap.GetHandle())
-                        saveDC.DeleteDC()
-                        mfcDC.DeleteDC()
-                        win32gui.ReleaseDC(hwnd, hwndDC)
-                        
-                        capture_type = "active window"
-                    except Exception:
-                        screenshot = pyautogui.screenshot()
-                        capture_type = "full screen (fallback)"
-                else:
-                    screenshot = pyautogui.screenshot()
-                    capture_type = "full screen (fallback)"
-            
-            self.root.deiconify()
-            self.button_window.deiconify()
-            
-            sanitized_title = ''.join(c for c in window_title if c.isalnum() or c in ' -_')[:30]
-            timestamp = datetime.now().strftime("%H%M%S")
-            filename = f"screenshot_{timestamp}_{sanitized_title}.png"
-            file_path = os.path.join(self.temp_dir, filename)
-            
-            # Save original high-resolution image
-            screenshot.save(file_path, quality=95)
-            
-            # Compress image for base64 encoding
-            compressed_img = self.compress_image(screenshot)
-            
-            # Convert screenshot to base64
-            buffered = BytesIO()
-            # screenshot.save(buffered, format="PNG", optimize=True)
-            compressed_img.save(buffered, format="PNG", optimize=True)
-            img_str_raw = base64.b64encode(buffered.getvalue()).decode()
-            
-            # Add data URI prefix to base64 string
-            # img_str = f"data:image/png;base64,{img_str_raw}"
-            img_str =img_str_raw
-            
-            # Create JSON payload with the base64 image
-            session_id = str(uuid.uuid4())
-            payload_json = {
-                "session_id": session_id,
-                "user_message": {
-                    "type": "image",
-                    "image": [img_str],
-                },
-                "conversation_history": [
-                    {
-                        "role": "user",
-                        "content": "get only the Inspector's Notes,Engine description and Fault parts and precautions accident from this image",
-                        "attachments": [
-                            {
-                                "type": "file",
-                                "base64String": [img_str]
-                            }
-                        ]
-                    }
-                ]
-            }
-            
-            # Comment out the API call and use mock response
-            result = self.make_api_call(payload_json)
-            
-            self.save_payload_to_file(payload_json)
-            
-            # Add to screenshots list (at the beginning)
-            self.screenshots.insert(0, {
-                "image": screenshot,
-                "title": window_title,
-                "timestamp": datetime.now().strftime("%H:%M:%S"),
-                "path": file_path,
-                "base64": img_str,
-                "payload_json": payload_json,
-                "api_response": result
-            })
-            
-            # Clear existing screenshots from UI
-            for widget in self.screenshots_container.winfo_children():
-                widget.destroy()
-            
-            # Update the UI with all screenshots (newest first)
-            for i in range(len(self.screenshots)):
-                self.add_screenshot_to_ui(i)
+            # Hand the pixels off; encoding and uploading happen on the pipeline workers.
+            # submit() blocks while the pipeline is full, which keeps is_capturing set
+            # and so throttles further clicks.
+            if self.batcher is not None:
+                queued = self.batcher.add(capture)
+                self.post_status(
+                    f"Captured {capture_type}: {window_title} "
+                    f"(batched {queued}/{self.batcher.max_items})",
+                    "info"
+                )
+                return
             
-            self.update_status(f"Captured {capture_type}: {window_title}", "success")
+            self.pipeline.submit(capture)
+            self.ui.post(self.show_loader)
+            self.post_status(
+                f"Captured {capture_type} via {capture['backend']}: {window_title} "
+                f"(processing {self.pipeline.pending})",
+                "info"
+            )
         
         except Exception as e:
-            self.update_status(f"Error capturing screenshot: {str(e)}", "error")
+            self.ui.post(self.show_app_windows)
+            self.post_status(f"Error capturing screenshot: {str(e)}", "error")
         
         finally:
             self.is_capturing = False
-            self.hide_loader()  # Hide loader when capture is complete
     
-    def compress_image(self, image, quality=40, max_size=1024):
-        """Compress image to reduce file size while maintaining quality"""
-        width, height = image.size
+    def hide_app_windows(self):
+        self.app_hidden.clear()
+        self.pending_unmap = {self.root, self.button_window}
+        self.root.withdraw()
+        self.button_window.withdraw()
+    
+    def on_app_unmap(self, event):
+        """<Unmap> handler; signals the capture thread once both windows are gone"""
+        if event.widget in self.pending_unmap:
+            self.pending_unmap.discard(event.widget)
+            if not self.pending_unmap:
+                self.app_hidden.set()
+    
+    def app_windows_mapped(self):
+        return self.root.winfo_ismapped() or self.button_window.winfo_ismapped()
+    
+    def wait_for_app_hidden(self):
+        """Block the capture thread until the app windows are unmapped.
+
+        <Unmap> events normally end the wait within a few ms; a short poll
+        covers windows that were already unmapped (and so never send the
+        event), and hide_timeout_ms caps the wait either way.
+        """
+        start = time.perf_counter()
+        deadline = start + self.settings["hide_timeout_ms"] / 1000
+        poll = self.settings["hide_poll_ms"] / 1000
+        while time.perf_counter() < deadline:
+            if self.app_hidden.wait(poll):
+                break
+            if not self.ui.call(self.app_windows_mapped, timeout=1):
+                break
+        # Give the compositor a moment to repaint what was underneath
+        time.sleep(self.settings["hide_settle_ms"] / 1000)
+        self.hide_stats.record((time.perf_counter() - start) * 1000)
+    
+    def show_app_windows(self):
+        self.root.deiconify()
+        self.button_window.deiconify()
+    
+    def stream_api_response(self, payload, entry):
+        """Show the card right away and fill in the response as it streams"""
+        entry["api_response"] = ""
+        entry["streaming"] = True
+        entry["streamed"] = True
+        self.ui.post(self.add_capture_entry, entry)
+        try:
+            for delta in self.processor.chat_client.stream(payload):
+                entry["api_response"] += delta
+                # Keyed, so a burst of deltas renders once per dispatcher tick
+                self.ui.post(self.refresh_stream, entry, key=("stream", entry["id"]))
+        except requests.exceptions.RequestException as e:
+            print("The error is:", str(e))
+            entry["api_failed"] = True  # keep the partial text on the card, but not in the cache
+        finally:
+            if not entry["api_response"]:
+                entry["api_response"] = "No API response available"
+                entry["api_failed"] = True
+            entry["streaming"] = False
+            self.ui.post(self.refresh_stream, entry, key=("stream", entry["id"]))
+    
+    def refresh_stream(self, entry):
+        card = self.screenshot_list.card_for(entry["id"])
+        if card is not None and card.data is entry:
+            card.update_stream()
+    
+    def load_history(self):
+        """Show the newest archived captures; only the index is read, no images"""
+        start = time.perf_counter()
+        entries = self.processor.archive.recent(self.settings["history_on_startup"])
+        for entry in reversed(entries):
+            self.capture_store.add(entry)
+        for entry in entries:
+            self.screenshot_list.append(entry)
+        if entries:
+            self.update_status(
+                f"Loaded {len(entries)} archived captures in "
+                f"{(time.perf_counter() - start) * 1000:.0f} ms",
+                "info"
+            )
+    
+    def add_capture_entry(self, entry):
+        # Add to screenshots list (at the beginning)
+        self.capture_store.add(entry)
         
-        # Resize if larger than max_size
-        if width > max_size or height > max_size:
-            if width > height:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            
-            image = image.resize((new_width, new_height), Image.LANCZOS)
+        # Only the new capture needs a card; existing cards stay in place
+        self.screenshot_list.prepend(entry)
+    
+    def on_capture_processed(self, item, result, error):
+        """Pipeline delivery callback; called in capture order"""
+        if "captures" in item:
+            entries = result or [None] * len(item["captures"])
+            for capture, entry in zip(item["captures"], entries):
+                self.ui.post(self.show_processed_capture, capture, entry, error)
+        else:
+            self.ui.post(self.show_processed_capture, item, result, error)
+    
+    def submit_batch(self, captures):
+        """CaptureBatcher flush callback; spreads a batch over batch_requests requests"""
+        requests_per_batch = max(1, min(self.settings["batch_requests"], len(captures)))
+        size = -(-len(captures) // requests_per_batch)
+        for i in range(0, len(captures), size):
+            self.pipeline.submit({"captures": captures[i:i + size]})
+        self.ui.post(self.show_loader)
+        self.post_status(f"Sent a batch of {len(captures)} captures", "info")
+    
+    def show_processed_capture(self, capture, entry, error):
+        if self.pipeline.pending == 0:
+            self.hide_loader()
+        
+        if error is not None:
+            self.update_status(f"Error processing {capture['title']}: {str(error)}", "error")
+            return
+        
+        if not entry.get("streamed"):
+            self.add_capture_entry(entry)
         
-        # Create compressed image
-        output = BytesIO()
-        image.save(output, format='PNG', optimize=True, quality=quality)
-        output.seek(0)
-        return Image.open(output)
+        cache_note = ""
+        if self.processor.response_cache is not None:
+            cache_note = f"{'cached answer, ' if entry.get('cache_hit') else ''}{self.processor.response_cache.describe()}; "
+        self.update_status(
+            f"Captured {capture['capture_type']} via {capture['backend']}: {capture['title']} "
+            f"(hide {self.hide_stats.describe()}; grab {self.grab_stats.describe()}; {cache_note}"
+            f"history: {self.capture_store.describe_memory()})",
+            "success"
+        )
+    
+    def post_status(self, message, status_type="info"):
+        """Thread-safe update_status; bursts collapse into the latest message"""
+        self.ui.post(self.update_status, message, status_type, key="status")
     
     def update_status(self, message, status_type="info"):
         self.status_message = message
@@ -885,92 +1510,38 @@ class ScreenshotApp:
             foreground=fg_color
         )
     
-    def add_screenshot_to_ui(self, index):
-        screenshot_data = self.screenshots[index]
-        
-        # Check if API response exists
-        response_text = screenshot_data.get("api_response", "No API response available")
-
-        frame = ttk.Frame(self.screenshots_container)
-        frame.pack(fill=tk.X, pady=(0, 15), padx=10)
-
-        # --- API Response Card ---
-        response_card = ttk.Frame(frame, relief="solid", borderwidth=1, padding=10)
-        response_card.pack(fill=tk.X, padx=5, pady=5)
-
-        # --- Scrollable Text Container ---
-        text_frame = ttk.Frame(response_card)
-        text_frame.pack(fill=tk.BOTH, expand=True)
-
-        # --- Scrollbars ---
-        v_scrollbar = ttk.Scrollbar(text_frame, orient="vertical")
-        
-        # --- Response Content with Markdown Formatting ---
-        response_content = MarkdownText(
-            text_frame,
-            wrap=tk.WORD,  # Wrap words to avoid horizontal scrolling unless necessary
-            height=20,  # Default height
-            width=70,
-            font=("Segoe UI", 10),
-            bg="#DBEAF7",
-            relief=tk.FLAT,
-            padx=10,
-            pady=5,
-            yscrollcommand=v_scrollbar.set,
-          
-        )
-        
-        # Insert Markdown text
-        response_content.insert_markdown(response_text)
-        
-        response_content.config(state=tk.DISABLED)  # Make it read-only
+    def get_thumbnail(self, screenshot_data):
+        """Return the card thumbnail for a capture, or None while it loads.
 
-        # Pack elements
-        v_scrollbar.config(command=response_content.yview)
-      
-        response_content.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
-        v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-      
-        # --- Screenshot Below ---
-        img = screenshot_data.get("image")
-        if img:
-            max_width = 600
-            width, height = img.size
-            ratio = min(max_width / width, 1.0)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            thumbnail = img.resize((new_width, new_height), Image.LANCZOS)
-            photo = ImageTk.PhotoImage(thumbnail)
-            screenshot_data["photo"] = photo
-            
-            image_frame = ttk.Frame(frame, borderwidth=1, relief="solid")
-            image_frame.pack(pady=5)
-            
-            image_label = ttk.Label(image_frame, image=photo)
-            image_label.image = photo
-            image_label.pack()
-        
-        # --- Header for Open Button ---
-        title_frame = ttk.Frame(frame)
-        title_frame.pack(fill=tk.X)
-        
-        title_label = ttk.Label(
-            title_frame,
-            text=f"{screenshot_data['title']} - {screenshot_data['timestamp']}",
-            font=("Arial", 10, "bold"),
-            foreground=self.colors["primary"]
-        )
-        title_label.pack(side=tk.LEFT, pady=5)
-        
-        open_button = ttk.Button(
-            title_frame,
-            text="Open Image",
-            command=lambda path=screenshot_data["path"]: self.open_screenshot(path),
-        )
-        open_button.pack(side=tk.RIGHT, padx=5)
-        
-        self.on_frame_configure(None)
+        New captures get theirs on the pipeline worker; archived ones are
+        loaded from the thumbnail cache in the background, so binding a
+        card never decodes a full-resolution image on the UI thread. The
+        cache's LRU owns every thumbnail, so a long session does not pin
+        one per capture.
+        """
+        image_hash = screenshot_data.get("image_hash")
+        if image_hash is None:
+            # Only entries made outside the archive lack a hash to cache under
+            if screenshot_data.get("image") is not None:
+                return make_thumbnail(screenshot_data["image"], self.processor.thumbnails.width)
+            return None
+        thumbnail = self.processor.thumbnails.get(image_hash)
+        if thumbnail is None:
+            self.processor.thumbnails.request(
+                image_hash,
+                screenshot_data["path"],
+                lambda thumbnail: self.ui.post(self.show_loaded_thumbnail, screenshot_data, thumbnail)
+            )
+        return thumbnail
     
+    def show_loaded_thumbnail(self, screenshot_data, thumbnail):
+        if thumbnail is None:
+            return
+        card = self.screenshot_list.card_for(screenshot_data["id"])
+        if card is not None and card.data is screenshot_data:
+            card.show_thumbnail(thumbnail)
+            self.screenshot_list.remeasure(screenshot_data["id"])
+
     def open_screenshot(self, path):
         try:
             if platform.system() == 'Windows':
@@ -988,40 +1559,56 @@ class ScreenshotApp:
     def open_screenshots_folder(self):
         try:
             if platform.system() == 'Windows':
-                os.startfile(self.temp_dir)
+                os.startfile(self.processor.archive.image_dir)
             elif platform.system() == 'Darwin':  # macOS
                 import subprocess
-                subprocess.call(['open', self.temp_dir])
+                subprocess.call(['open', self.processor.archive.image_dir])
             else:  # Linux
                 import subprocess
-                subprocess.call(['xdg-open', self.temp_dir])
+                subprocess.call(['xdg-open', self.processor.archive.image_dir])
         except Exception as e:
             self.update_status(f"Error opening folder: {str(e)}", "error")
     
+    def on_temp_cleanup(self, removed, freed):
+        self.post_status(
+            f"Removed {removed} old temp files ({freed / (1024 * 1024):.1f} MB); "
+            f"{self.storage.describe()}",
+            "info"
+        )
+    
+    def on_archive_cleanup(self, removed, freed):
+        self.post_status(
+            f"Removed {removed} old archived files ({freed / (1024 * 1024):.1f} MB); "
+            f"{self.processor.storage.describe()}",
+            "info"
+        )
+    
     def on_close(self):
+        if self.batcher is not None:
+            self.batcher.close()
+        # Queued captures still need the processor's session, journal and
+        # archive; let them finish out of sight before closing it
+        self.root.withdraw()
+        self.button_window.withdraw()
+        if not self.pipeline.drain(self.settings["pipeline_drain_timeout"]):
+            print(f"Closing with {self.pipeline.pending} captures still in flight")
+        self.storage.stop()
+        self.ui.stop()
+        self.pipeline.shutdown()
+        self.processor.close()
+        print("Backend metrics:", json.dumps(self.backends.metrics()))
+        print("Capture latency:", json.dumps({
+            "hide": self.hide_stats.summary(),
+            "grab": self.grab_stats.summary(),
+        }))
+        self.backends.close()
         self.root.destroy()
         
-    def make_api_call(self, payload):
-        self.show_loader()  # Show loader centered on the screen
-        try:
-            url = "http://localhost:8001/v1/chat"
-            headers = {
-                "Content-Type": "application/json",
-            }
-
-            response = requests.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-
-            return response.json().get("assistant_message")
-
-        except requests.exceptions.RequestException as e:
-            print("The error is:", str(e))
-            return None
-
-        finally:
-            self.hide_loader()  # Hide loader when API call is complete
-
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Headless commands; "python capture_core.py ..." runs them without Tk
+        from capture_core import main
+        sys.exit(main())
     root = tk.Tk()
     app = ScreenshotApp(root)
     root.mainloop()
\ No newline at end of file
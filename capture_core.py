@@ -0,0 +1,2529 @@
+"""Capture, encode, upload and archive screenshots without a GUI.
+
+Everything here works without Tk: capture_active_window.py builds the
+floating-button app on top of it, and running this module directly
+processes captures headlessly:
+
+    python capture_core.py ingest [-r] PATH...
+    python capture_core.py capture [--interval S] [--count N] [--region x,y,w,h]
+    python capture_core.py search [--limit N] TEXT
+"""
+import time
+import os
+import sys
+import argparse
+import contextlib
+import platform
+import tempfile
+import threading
+import queue
+import base64
+import ctypes
+from PIL import Image, ImageChops, ImageFilter
+from io import BytesIO
+from datetime import datetime
+import json
+import hashlib
+import uuid
+import requests
+import re
+import sqlite3
+from collections import OrderedDict, deque
+from itertools import cycle
+
+# Defaults for settings.json in the script directory
+DEFAULT_SETTINGS = {
+    "ram_budget_mb": 256,  # resident full images and payloads in the capture history
+    "upload_format": "png",  # png, webp or jpeg
+    "upload_quality": 80,  # lossy formats only
+    "upload_max_size": 1024,  # longest side of the uploaded image, in pixels
+    "archive_format": "png",  # full-resolution copy kept in the temp directory
+    "api_url": "http://localhost:8001/v1/chat",
+    "api_connect_timeout": 3.05,  # seconds
+    "api_read_timeout": 120,  # seconds; model generation can be slow
+    "api_retries": 2,  # extra attempts on connection errors and 5xx
+    "api_backoff": 0.5,  # seconds, doubled after each retry
+    "api_stream": False,  # render the response progressively (needs a streaming backend)
+    "payload_image_refs": False,  # attachments reference user_message.image (server opt-in)
+    "temp_max_mb": 512,  # quota for all sessions' temp directories together
+    "temp_max_age_hours": 24,
+    "temp_cleanup_interval": 600,  # seconds between cleanup passes
+    "archive_dir": None,  # defaults to capture_archive next to this script
+    "history_on_startup": 20,  # archived captures shown when the app starts
+    "thumbnail_width": 600,  # card thumbnails, in pixels
+    "journal_dir": None,  # defaults to payload_journal next to this script
+    "journal_max_mb": 16,  # rotate journal.jsonl beyond this size
+    "journal_max_files": 5,  # rotated journals to keep
+    "journal_fsync": "rotate",  # "always", "rotate" or "never"
+    "storage_max_mb": 2048,  # quota for archived images, thumbnails and journaled images together
+    "storage_max_age_days": 30,
+    "batch_size": 1,  # > 1 sends up to this many captures in one request
+    "batch_window": 10.0,  # seconds a batch waits for more captures
+    "batch_requests": 1,  # concurrent requests a batch is spread over
+    # Title regex -> list of [left, top, right, bottom] fractions to upload instead of the whole window
+    "roi_templates": {},
+    "roi_detect_text": False,  # otherwise look for dense text blocks and upload only those
+    "roi_max_regions": 4,
+    "roi_max_size": 2048,  # crops are sent at native resolution up to this size
+    "skip_unchanged": False,  # don't re-upload a window whose pixels have not changed
+    "diff_sample_step": 4,  # average NxN pixel cells before comparing
+    "diff_pixel_threshold": 8,  # grayscale levels a cell must move to count as changed
+    "diff_min_changed": 0.0,  # fraction of cells that must change
+    "response_cache": True,  # reuse answers for byte-identical uploads of the same window
+    "response_cache_dir": None,  # defaults to es_response_cache in the system temp dir
+    "response_cache_entries": 500,
+    "response_cache_ttl": 3600,  # seconds
+    # Reduced cells (diff_sample_step squares) that may differ for a same-window near-duplicate
+    # to reuse an answer; None for byte-identical uploads only. A cursor blink or a clock tick
+    # moves about 5 cells, but so does editing one digit, so raise this with care.
+    "response_cache_near_cells": 0,
+    "hide_timeout_ms": 600,  # upper bound on waiting for our windows to unmap
+    "hide_poll_ms": 10,  # fallback poll of the window mapped state
+    "hide_settle_ms": 30,  # extra delay after unmap for the compositor to repaint
+    "pipeline_workers": 2,  # captures encoded and uploaded concurrently
+    "pipeline_max_pending": 4,  # queued or in-flight captures before the button blocks
+    "pipeline_drain_timeout": 30,  # seconds on exit for queued captures to finish
+}
+
+CAPTURE_PROMPT = "get only the Inspector's Notes,Engine description and Fault parts and precautions accident from this image"
+
+# Batched answers are split on "## Screenshot <n>" headings
+BATCH_HEADING = re.compile(r'^#{1,6}\s*Screenshot\s+(\d+)\b.*$', re.MULTILINE | re.IGNORECASE)
+
+class EncodedImage:
+    """Result of an upload encode: the bytes plus what produced them"""
+    def __init__(self, data, fmt, mime_type, image, timings):
+        self.data = data
+        self.format = fmt
+        self.mime_type = mime_type
+        self.image = image  # the resized image that was encoded
+        self.timings = timings  # stage name -> milliseconds
+
+
+class ImageEncoder:
+    """Encode captures for upload and for the archive, each in a single pass.
+
+    The upload path resizes once and encodes straight to bytes; nothing is
+    decoded again. Output formats are pluggable through FORMATS; lossy
+    formats honour a real quality setting, PNG uses a fixed zlib level
+    rather than the very slow optimize pass.
+    """
+    FORMATS = {
+        "png": {"pil_format": "PNG", "mime": "image/png", "extension": "png", "lossy": False},
+        "webp": {"pil_format": "WEBP", "mime": "image/webp", "extension": "webp", "lossy": True},
+        "jpeg": {"pil_format": "JPEG", "mime": "image/jpeg", "extension": "jpg", "lossy": True},
+    }
+
+    def __init__(self, upload_format="png", upload_quality=80, max_size=1024,
+                 archive_format="png", png_compress_level=6, archive_compress_level=1):
+        for fmt in (upload_format, archive_format):
+            if fmt not in self.FORMATS:
+                raise ValueError(f"Unsupported image format: {fmt}")
+        self.upload_format = upload_format
+        self.upload_quality = upload_quality
+        self.max_size = max_size
+        self.archive_format = archive_format
+        self.png_compress_level = png_compress_level
+        self.archive_compress_level = archive_compress_level
+
+    @property
+    def archive_extension(self):
+        return self.FORMATS[self.archive_format]["extension"]
+
+    def resize_for_upload(self, image, max_size=None):
+        """Scale the longest side down to max_size; smaller images pass through"""
+        max_size = max_size or self.max_size
+        width, height = image.size
+        if width <= max_size and height <= max_size:
+            return image
+        if width > height:
+            new_size = (max_size, int(height * (max_size / width)))
+        else:
+            new_size = (int(width * (max_size / height)), max_size)
+        # reducing_gap does a cheap box reduction first, then LANCZOS on the rest
+        return image.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+    def _save_options(self, fmt, quality, compress_level):
+        if fmt == "png":
+            return {"compress_level": compress_level}
+        if fmt == "webp":
+            return {"quality": quality, "method": 4}
+        return {"quality": quality, "optimize": False}
+
+    def _prepare_mode(self, image, fmt):
+        if fmt == "jpeg" and image.mode not in ("RGB", "L"):
+            return image.convert("RGB")
+        return image
+
+    def encode(self, image, fmt, quality=None, compress_level=None, fp=None):
+        """Encode image to fp (or a new buffer) in a single pass"""
+        spec = self.FORMATS[fmt]
+        options = self._save_options(
+            fmt,
+            self.upload_quality if quality is None else quality,
+            self.png_compress_level if compress_level is None else compress_level
+        )
+        target = fp if fp is not None else BytesIO()
+        self._prepare_mode(image, fmt).save(target, format=spec["pil_format"], **options)
+        return target
+
+    def encode_upload(self, image, max_size=None):
+        """Resize and encode the image that gets sent to the chat API"""
+        timings = {}
+        start = time.perf_counter()
+        resized = self.resize_for_upload(image, max_size)
+        timings["resize"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        data = self.encode(resized, self.upload_format).getvalue()
+        timings["encode"] = (time.perf_counter() - start) * 1000
+
+        spec = self.FORMATS[self.upload_format]
+        return EncodedImage(data, self.upload_format, spec["mime"], resized, timings)
+
+    def encode_archive(self, image):
+        """Encode the full-resolution copy with a fast lossless setting"""
+        return self.encode(image, self.archive_format, quality=95,
+                           compress_level=self.archive_compress_level).getvalue()
+
+    def save_archive(self, image, path):
+        with open(path, "wb") as f:
+            f.write(self.encode_archive(image))
+        return path
+
+
+class RegionSelector:
+    """Pick the parts of a capture worth uploading.
+
+    Templates map a regular expression on the window title to regions
+    given as (left, top, right, bottom) fractions of the window, so they
+    survive window resizes. Without a matching template, and when
+    detect_text is on, a local heuristic looks for dense text: horizontal
+    gradients are thresholded, dilated into blocks and split with an XY
+    cut on empty rows and columns. An empty result means "send the whole
+    window".
+    """
+    def __init__(self, templates=None, detect_text=False, max_regions=4,
+                 min_saving=0.2, margin=8):
+        self.templates = [(re.compile(pattern), regions) for pattern, regions in (templates or {}).items()]
+        self.detect_text = detect_text
+        self.max_regions = max_regions
+        self.min_saving = min_saving  # skip cropping unless it drops this share of the pixels
+        self.margin = margin
+        self.scale = 2  # detection runs on a half-size copy
+        self.edge_threshold = 40
+        self.min_gap = 12  # empty rows/columns (at detection scale) that separate blocks
+        self.min_density = 0.08
+
+    def select(self, title, image):
+        """Return a list of (left, top, right, bottom) pixel boxes, or []"""
+        width, height = image.size
+        boxes = []
+        for pattern, regions in self.templates:
+            if pattern.search(title):
+                boxes = [
+                    (int(l * width), int(t * height), int(r * width), int(b * height))
+                    for l, t, r, b in regions
+                ]
+                break
+        else:
+            if self.detect_text:
+                boxes = self.detect_text_blocks(image)
+
+        boxes = [box for box in boxes if box[2] > box[0] and box[3] > box[1]]
+        covered = sum((r - l) * (b - t) for l, t, r, b in boxes)
+        if not boxes or covered > (1 - self.min_saving) * width * height:
+            return []
+        return boxes
+
+    def detect_text_blocks(self, image):
+        small = image.convert("L").reduce(self.scale)
+        edges = ImageChops.difference(small, ImageChops.offset(small, 1, 0))
+        mask = edges.point(lambda v: 255 if v > self.edge_threshold else 0)
+        # Grow strokes into solid lines and paragraphs
+        mask = mask.filter(ImageFilter.MaxFilter(5))
+
+        blocks = []
+        for band in self._split(mask, (0, 0) + mask.size, axis=1):
+            for block in self._split(mask, band, axis=0):
+                blocks.extend(self._split(mask, block, axis=1))
+        blocks = [box for box in blocks if self._density(mask, box) >= self.min_density]
+        blocks = self._merge(blocks)
+
+        width, height = image.size
+        pad = self.margin
+        return [
+            (max(0, l * self.scale - pad), max(0, t * self.scale - pad),
+             min(width, r * self.scale + pad), min(height, b * self.scale + pad))
+            for l, t, r, b in blocks
+        ]
+
+    def _profile(self, mask, box, axis):
+        """Mean mask value of each row (axis=1) or column (axis=0) in box"""
+        region = mask.crop(box)
+        size = (1, region.size[1]) if axis == 1 else (region.size[0], 1)
+        return list(region.resize(size, Image.BOX).getdata())
+
+    def _split(self, mask, box, axis):
+        """Cut box along runs of at least min_gap empty rows or columns"""
+        left, top, right, bottom = box
+        if right <= left or bottom <= top:
+            return []
+        profile = self._profile(mask, box, axis)
+        pieces = []
+        start, gap = None, 0
+        for i, value in enumerate(profile + [0] * self.min_gap):
+            if value:
+                if start is None:
+                    start = i
+                gap = 0
+            elif start is not None:
+                gap += 1
+                if gap >= self.min_gap:
+                    pieces.append((start, i - gap + 1))
+                    start, gap = None, 0
+        if axis == 1:
+            return [(left, top + a, right, top + b) for a, b in pieces]
+        return [(left + a, top, left + b, bottom) for a, b in pieces]
+
+    def _density(self, mask, box):
+        region = mask.crop(box)
+        return region.resize((1, 1), Image.BOX).getpixel((0, 0)) / 255
+
+    def _merge(self, boxes):
+        """Union the closest boxes until at most max_regions remain"""
+        boxes = sorted(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]), reverse=True)
+        while len(boxes) > self.max_regions:
+            best = None
+            for i in range(len(boxes)):
+                for j in range(i + 1, len(boxes)):
+                    a, b = boxes[i], boxes[j]
+                    union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    growth = ((union[2] - union[0]) * (union[3] - union[1])
+                              - (a[2] - a[0]) * (a[3] - a[1]) - (b[2] - b[0]) * (b[3] - b[1]))
+                    if best is None or growth < best[0]:
+                        best = (growth, i, j, union)
+            _, i, j, union = best
+            boxes = [box for k, box in enumerate(boxes) if k not in (i, j)] + [union]
+        return boxes
+
+
+class X11WindowInfo:
+    """Active-window queries over one persistent X connection.
+
+    Replaces forking xdotool three times per capture. Needs the optional
+    python-xlib package; pass display_name (e.g. ":99" for Xvfb) to query
+    a display other than $DISPLAY.
+    """
+    def __init__(self, display_name=None):
+        from Xlib import X, display
+
+        self.X = X
+        self.display = display.Display(display_name)
+        self.root = self.display.screen().root
+        self.NET_ACTIVE_WINDOW = self.display.intern_atom("_NET_ACTIVE_WINDOW")
+        self.NET_WM_NAME = self.display.intern_atom("_NET_WM_NAME")
+        self.UTF8_STRING = self.display.intern_atom("UTF8_STRING")
+        self._lock = threading.Lock()
+
+    def get_window_info(self):
+        """Return (title, (x, y, width, height)) or None if no window is active"""
+        with self._lock:
+            active = self.root.get_full_property(self.NET_ACTIVE_WINDOW, self.X.AnyPropertyType)
+            if active is None or not active.value or not active.value[0]:
+                return None
+            window = self.display.create_resource_object("window", active.value[0])
+
+            name = window.get_full_property(self.NET_WM_NAME, self.UTF8_STRING)
+            if name is not None and name.value:
+                title = name.value.decode("utf-8", "replace") if isinstance(name.value, bytes) else str(name.value)
+            else:
+                title = window.get_wm_name() or ""
+                if isinstance(title, bytes):
+                    title = title.decode("latin-1")
+
+            geometry = window.get_geometry()
+            origin = self.root.translate_coords(window, 0, 0)
+            return title, (origin.x, origin.y, geometry.width, geometry.height)
+
+    def close(self):
+        with self._lock:
+            self.display.close()
+
+
+class XShmCapture:
+    """Grab screen regions through the X shared-memory extension.
+
+    Only the requested rectangle is copied by the X server, straight into a
+    SysV shared-memory segment mapped in this process; there is no
+    full-screen allocation and no helper process. The segment is reused
+    while the region size stays the same. Because it is reused and the
+    pipeline keeps images around, grab() does a single BGRX -> RGB unpack
+    out of the segment into the returned PIL image.
+
+    Talks to libX11/libXext through ctypes. Only 24/32-bit TrueColor
+    visuals are supported; anything else raises at construction so the
+    caller can fall back to pyautogui.
+    """
+    ZPIXMAP = 2
+    IPC_PRIVATE = 0
+    IPC_CREAT = 0o1000
+    IPC_RMID = 0
+    ALL_PLANES = ctypes.c_ulong(-1).value
+
+    class XShmSegmentInfo(ctypes.Structure):
+        _fields_ = [
+            ("shmseg", ctypes.c_ulong),
+            ("shmid", ctypes.c_int),
+            ("shmaddr", ctypes.c_void_p),
+            ("readOnly", ctypes.c_int),
+        ]
+
+    class XImage(ctypes.Structure):
+        _fields_ = [
+            ("width", ctypes.c_int),
+            ("height", ctypes.c_int),
+            ("xoffset", ctypes.c_int),
+            ("format", ctypes.c_int),
+            ("data", ctypes.c_void_p),
+            ("byte_order", ctypes.c_int),
+            ("bitmap_unit", ctypes.c_int),
+            ("bitmap_bit_order", ctypes.c_int),
+            ("bitmap_pad", ctypes.c_int),
+            ("depth", ctypes.c_int),
+            ("bytes_per_line", ctypes.c_int),
+            ("bits_per_pixel", ctypes.c_int),
+            ("red_mask", ctypes.c_ulong),
+            ("green_mask", ctypes.c_ulong),
+            ("blue_mask", ctypes.c_ulong),
+            ("obdata", ctypes.c_void_p),
+            ("f", ctypes.c_void_p * 6),
+        ]
+
+    def __init__(self, display_name=None):
+        from ctypes.util import find_library
+
+        x11 = ctypes.CDLL(find_library("X11"))
+        xext = ctypes.CDLL(find_library("Xext"))
+        libc = ctypes.CDLL(find_library("c"), use_errno=True)
+
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+
+        image_p = ctypes.POINTER(self.XImage)
+        shminfo_p = ctypes.POINTER(self.XShmSegmentInfo)
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = image_p
+        xext.XShmCreateImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+            ctypes.c_char_p, shminfo_p, ctypes.c_uint, ctypes.c_uint,
+        ]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, shminfo_p]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, shminfo_p]
+        xext.XShmGetImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, image_p, ctypes.c_int, ctypes.c_int, ctypes.c_ulong,
+        ]
+
+        libc.shmget.restype = ctypes.c_int
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+        self.x11, self.xext, self.libc = x11, xext, libc
+        self.display = x11.XOpenDisplay(display_name.encode() if display_name else None)
+        if not self.display:
+            raise RuntimeError("Cannot open X display")
+        if not xext.XShmQueryExtension(self.display):
+            x11.XCloseDisplay(self.display)
+            raise RuntimeError("X server has no MIT-SHM extension")
+
+        screen = x11.XDefaultScreen(self.display)
+        self.root = x11.XDefaultRootWindow(self.display)
+        self.visual = x11.XDefaultVisual(self.display, screen)
+        self.depth = x11.XDefaultDepth(self.display, screen)
+        self.screen_size = (x11.XDisplayWidth(self.display, screen), x11.XDisplayHeight(self.display, screen))
+        if self.depth not in (24, 32):
+            x11.XCloseDisplay(self.display)
+            raise RuntimeError(f"Unsupported X visual depth {self.depth}")
+
+        self._image = None
+        self._shminfo = None
+        self._lock = threading.Lock()
+
+    def _allocate(self, width, height):
+        self._release_segment()
+        shminfo = self.XShmSegmentInfo()
+        image = self.xext.XShmCreateImage(
+            self.display, self.visual, self.depth, self.ZPIXMAP, None,
+            ctypes.byref(shminfo), width, height
+        )
+        if not image:
+            raise RuntimeError("XShmCreateImage failed")
+        contents = image.contents
+        if contents.bits_per_pixel != 32 or contents.red_mask != 0xFF0000:
+            self._destroy_image(image)
+            raise RuntimeError("Unsupported X pixel layout")
+
+        size = contents.bytes_per_line * height
+        shminfo.shmid = self.libc.shmget(self.IPC_PRIVATE, size, self.IPC_CREAT | 0o600)
+        if shminfo.shmid < 0:
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        shminfo.shmaddr = self.libc.shmat(shminfo.shmid, None, 0)
+        if shminfo.shmaddr in (None, ctypes.c_void_p(-1).value):
+            self.libc.shmctl(shminfo.shmid, self.IPC_RMID, None)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        shminfo.readOnly = 0
+        contents.data = shminfo.shmaddr
+
+        self.xext.XShmAttach(self.display, ctypes.byref(shminfo))
+        self.x11.XSync(self.display, 0)
+        # Mark for removal now; the kernel frees it once both sides detach
+        self.libc.shmctl(shminfo.shmid, self.IPC_RMID, None)
+
+        self._image = image
+        self._shminfo = shminfo
+
+    def _release_segment(self):
+        if self._shminfo is None:
+            return
+        self.xext.XShmDetach(self.display, ctypes.byref(self._shminfo))
+        self.x11.XSync(self.display, 0)
+        self.libc.shmdt(self._shminfo.shmaddr)
+        self._destroy_image(self._image)
+        self._image = None
+        self._shminfo = None
+
+    def _destroy_image(self, image):
+        # XDestroyImage is a macro for image->f.destroy_image, which would also
+        # free data; that belongs to the shared segment, so clear it first
+        image.contents.data = None
+        destroy = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(self.XImage))(image.contents.f[1])
+        destroy(image)
+
+    def grab(self, x, y, width, height):
+        """Return the given screen rectangle as an RGB PIL image"""
+        # Requests outside the root window raise a fatal X error; clip first
+        screen_width, screen_height = self.screen_size
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + width, screen_width), min(y + height, screen_height)
+        if right <= left or bottom <= top:
+            raise ValueError("Region is outside the screen")
+        width, height = right - left, bottom - top
+
+        with self._lock:
+            if self._image is None or (self._image.contents.width, self._image.contents.height) != (width, height):
+                self._allocate(width, height)
+            if not self.xext.XShmGetImage(self.display, self.root, self._image, left, top, self.ALL_PLANES):
+                raise RuntimeError("XShmGetImage failed")
+            stride = self._image.contents.bytes_per_line
+            buffer = (ctypes.c_char * (stride * height)).from_address(self._shminfo.shmaddr)
+            return Image.frombuffer("RGB", (width, height), buffer, "raw", "BGRX", stride, 1)
+
+    def close(self):
+        with self._lock:
+            self._release_segment()
+            if self.display:
+                self.x11.XCloseDisplay(self.display)
+                self.display = None
+
+
+def window_info_win32():
+    """Foreground window title and bounds through user32"""
+    from ctypes.wintypes import RECT
+    
+    user32 = ctypes.windll.user32
+    foreground_window = user32.GetForegroundWindow()
+    
+    length = user32.GetWindowTextLengthW(foreground_window)
+    buff = ctypes.create_unicode_buffer(length + 1)
+    user32.GetWindowTextW(foreground_window, buff, length + 1)
+    title = buff.value
+    
+    rect = RECT()
+    user32.GetWindowRect(foreground_window, ctypes.byref(rect))
+    bounds = (rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top)
+    
+    return title, bounds
+
+
+def window_info_osascript():
+    """Frontmost application name and first window bounds through osascript"""
+    import subprocess
+    
+    title_cmd = """osascript -e 'tell application "System Events" to get name of first process whose frontmost is true'"""
+    title = subprocess.check_output(title_cmd, shell=True).decode('utf-8').strip()
+    
+    bounds_script = """
+    osascript -e '
+    tell application "System Events"
+        set frontApp to first application process whose frontmost is true
+        set frontAppName to name of frontApp
+        tell process frontAppName
+            set appWindow to first window
+            set {x, y} to position of appWindow
+            set {width, height} to size of appWindow
+            return x & "," & y & "," & width & "," & height
+        end tell
+    end tell
+    '
+    """
+    
+    result = subprocess.check_output(bounds_script, shell=True).decode('utf-8').strip()
+    bounds = [int(val) for val in result.split(',')]
+    return title, tuple(bounds)
+
+
+def window_info_xdotool():
+    """Active window title and bounds via three xdotool subprocesses"""
+    import subprocess
+    
+    win_id_cmd = ["xdotool", "getactivewindow"]
+    win_id = subprocess.check_output(win_id_cmd).decode('utf-8').strip()
+    
+    name_cmd = ["xdotool", "getwindowname", win_id]
+    title = subprocess.check_output(name_cmd).decode('utf-8').strip()
+    
+    geo_cmd = ["xdotool", "getwindowgeometry", win_id]
+    geo_output = subprocess.check_output(geo_cmd).decode('utf-8')
+    
+    pos_line = [line for line in geo_output.split('\n') if "Position" in line][0]
+    pos_parts = pos_line.split(":")[1].strip().split(",")
+    x = int(pos_parts[0])
+    y = int(pos_parts[1].split()[0])
+    
+    size_line = [line for line in geo_output.split('\n') if "Geometry" in line][0]
+    size_parts = size_line.split(":")[1].strip().split("x")
+    width = int(size_parts[0])
+    height = int(size_parts[1])
+    
+    return title, (x, y, width, height)
+
+
+def grab_printwindow():
+    """Render the foreground window with PrintWindow (works without bounds)"""
+    import win32gui
+    import win32ui
+    from ctypes import windll
+    
+    hwnd = win32gui.GetForegroundWindow()
+    
+    left, top, right, bottom = win32gui.GetWindowRect(hwnd)
+    width = right - left
+    height = bottom - top
+    
+    hwndDC = win32gui.GetWindowDC(hwnd)
+    mfcDC = win32ui.CreateDCFromHandle(hwndDC)
+    saveDC = mfcDC.CreateCompatibleDC()
+    
+    saveBitMap = win32ui.CreateBitmap()
+    saveBitMap.CreateCompatibleBitmap(mfcDC, width, height)
+    
+    saveDC.SelectObject(saveBitMap)
+    
+    windll.user32.PrintWindow(hwnd, saveDC.GetSafeHdc(), 0)
+    
+    bmpinfo = saveBitMap.GetInfo()
+    bmpstr = saveBitMap.GetBitmapBits(True)
+    screenshot = Image.frombuffer(
+        'RGB',
+        (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
+        bmpstr, 'raw', 'BGRX', 0, 1)
+    
+    win32gui.DeleteObject(saveBitMap.GetHandle())
+    saveDC.DeleteDC()
+    mfcDC.DeleteDC()
+    win32gui.ReleaseDC(hwnd, hwndDC)
+    
+    return screenshot
+
+
+class CaptureBackends:
+    """Registry of window-info and pixel-grab strategies for this host.
+
+    Backends are registered per kind ("window_info", "grab" for a screen
+    region, "window_grab" for the foreground window without bounds,
+    "screen" for the full-screen fallback). probe() runs once at startup:
+    it builds every backend that applies to this platform, times a sample
+    call, and ranks the working ones by that latency. call() then goes
+    straight to the fastest; a backend that raises is moved to the back
+    of its list instead of being retried first on every capture. A call
+    made while the probe is still running waits at most probe_wait
+    seconds for it, then tries the unprobed candidates in registration
+    order.
+    """
+    KINDS = ("window_info", "grab", "window_grab", "screen")
+
+    def __init__(self, probe_wait=2.0):
+        self.probe_wait = probe_wait
+        self.candidates = {kind: [] for kind in self.KINDS}
+        self.ranked = {kind: [] for kind in self.KINDS}  # [(name, fn)], fastest first
+        self.unranked = {}  # kind -> [(name, fn)] built for calls that outran the probe
+        self.probe_results = {}  # (kind, name) -> probe ms, or the error text
+        self.stats = {}  # backend name -> LatencyStats
+        self.last_used = {}  # kind -> backend name
+        self.ready = threading.Event()
+        self._closeables = []
+        self._lock = threading.Lock()
+
+    def register(self, kind, name, factory, probe=None, platforms=None):
+        """Add a candidate.
+
+        factory() returns the callable used for captures (building it may
+        import optional modules or open connections). probe(fn) exercises
+        it once; it defaults to just building it.
+        """
+        self.candidates[kind].append((name, factory, probe, platforms))
+
+    def probe(self):
+        system = platform.system()
+        for kind, candidates in self.candidates.items():
+            ranked = []
+            for name, factory, probe, platforms in candidates:
+                if platforms and system not in platforms:
+                    continue
+                try:
+                    fn = factory()
+                    owner = getattr(fn, "__self__", None)
+                    if hasattr(owner, "close"):
+                        self._closeables.append(owner)
+                    # Rank on the per-capture cost, not one-time setup
+                    start = time.perf_counter()
+                    if probe is not None:
+                        probe(fn)
+                except Exception as e:
+                    self.probe_results[(kind, name)] = f"unavailable: {e}"
+                    continue
+                elapsed = (time.perf_counter() - start) * 1000
+                self.probe_results[(kind, name)] = elapsed
+                self.stats.setdefault(name, LatencyStats())
+                ranked.append((elapsed, name, fn))
+            ranked.sort(key=lambda item: item[0])
+            with self._lock:
+                self.ranked[kind] = [(name, fn) for _, name, fn in ranked]
+        self.ready.set()
+
+    def _unprobed(self, kind):
+        """Candidates of a kind built without timing them, in registration order"""
+        with self._lock:
+            if kind in self.unranked:
+                return self.unranked[kind]
+        system = platform.system()
+        built = []
+        for name, factory, _, platforms in self.candidates[kind]:
+            if platforms and system not in platforms:
+                continue
+            try:
+                fn = factory()
+            except Exception as e:
+                print(f"{kind} backend {name} unavailable:", str(e))
+                continue
+            owner = getattr(fn, "__self__", None)
+            if hasattr(owner, "close"):
+                self._closeables.append(owner)
+            built.append((name, fn))
+        with self._lock:
+            return self.unranked.setdefault(kind, built)
+
+    def call(self, kind, *args):
+        """Run the fastest working backend of a kind; returns (name, result).
+
+        A None result (e.g. no active window) falls through to the next
+        backend. Raises RuntimeError when none of them produce a result.
+        """
+        probed = self.ready.wait(self.probe_wait)
+        with self._lock:
+            order = self.ranked[kind]
+        if not probed and not order:
+            # A hung probe (e.g. a display that stopped answering) must not
+            # hold up a capture while the app windows are hidden
+            order = self._unprobed(kind)
+        with self._lock:
+            backends = list(order)
+        for name, fn in backends:
+            stats = self.stats.setdefault(name, LatencyStats())
+            start = time.perf_counter()
+            try:
+                result = fn(*args)
+            except Exception as e:
+                stats.record((time.perf_counter() - start) * 1000, ok=False)
+                print(f"{kind} backend {name} failed:", str(e))
+                with self._lock:
+                    if (name, fn) in order:
+                        order.remove((name, fn))
+                        order.append((name, fn))
+                continue
+            stats.record((time.perf_counter() - start) * 1000)
+            if result is not None:
+                self.last_used[kind] = name
+                return name, result
+        raise RuntimeError(f"No working {kind} backend")
+
+    def chosen(self, kind):
+        with self._lock:
+            return self.ranked[kind][0][0] if self.ranked[kind] else None
+
+    def describe(self):
+        parts = []
+        for kind in ("window_info", "grab"):
+            name = self.chosen(kind)
+            if name is None:
+                parts.append(f"{kind}=none")
+            else:
+                parts.append(f"{kind}={name} ({self.probe_results[(kind, name)]:.1f} ms)")
+        return ", ".join(parts)
+
+    def metrics(self):
+        return {
+            "chosen": {kind: self.chosen(kind) for kind in self.KINDS},
+            "probe": {f"{kind}/{name}": result for (kind, name), result in self.probe_results.items()},
+            "latency": {name: stats.summary() for name, stats in self.stats.items()},
+        }
+
+    def close(self):
+        for owner in self._closeables:
+            try:
+                owner.close()
+            except Exception:
+                pass
+
+
+def default_backends():
+    """All capture strategies this app knows about, native ones first"""
+    backends = CaptureBackends()
+    probe_region = (0, 0, 16, 16)
+
+    backends.register("window_info", "user32", lambda: window_info_win32,
+                      probe=lambda fn: fn(), platforms=("Windows",))
+    backends.register("window_info", "osascript", lambda: window_info_osascript,
+                      probe=lambda fn: fn(), platforms=("Darwin",))
+    backends.register("window_info", "xlib", lambda: X11WindowInfo().get_window_info,
+                      probe=lambda fn: fn(), platforms=("Linux",))
+    backends.register("window_info", "xdotool", lambda: window_info_xdotool,
+                      probe=lambda fn: fn(), platforms=("Linux",))
+
+    backends.register("grab", "xshm", lambda: XShmCapture().grab,
+                      probe=lambda fn: fn(*probe_region), platforms=("Linux",))
+    # pyautogui needs a display at import time, so it is only imported when probed
+    def pyautogui_region_factory():
+        import pyautogui
+        return lambda x, y, w, h: pyautogui.screenshot(region=(x, y, w, h))
+
+    def pyautogui_screen_factory():
+        import pyautogui
+        return pyautogui.screenshot
+
+    backends.register("grab", "pyautogui", pyautogui_region_factory,
+                      probe=lambda fn: fn(*probe_region))
+
+    def printwindow_factory():
+        import win32gui
+        import win32ui
+        return grab_printwindow
+
+    backends.register("window_grab", "printwindow", printwindow_factory, platforms=("Windows",))
+    backends.register("screen", "pyautogui-fullscreen", pyautogui_screen_factory)
+    return backends
+
+
+class ChatPayload:
+    """A /v1/chat request body that holds each image's bytes exactly once.
+
+    The JSON is never built as one big string: open() returns a file-like
+    reader that emits the body in chunks, base64-encoding the images
+    straight from their byte buffers as it goes. Its exact length is known
+    up front, so requests sends a Content-Length instead of chunking.
+
+    The backend expects every image twice, in user_message.image and in
+    the first history entry's attachments. With use_references=True the
+    attachment instead points at user_message.image[i], which halves the
+    body for servers that support it.
+    """
+    CHUNK_SIZE = 3 * 16 * 1024  # multiple of 3 so base64 chunks concatenate cleanly
+
+    def __init__(self, images, prompt, session_id=None, use_references=False, stream=False):
+        self.images = list(images)  # encoded image bytes
+        self.prompt = prompt
+        self.session_id = session_id or str(uuid.uuid4())
+        self.use_references = use_references
+        self.stream = stream
+
+    def _segments(self):
+        """The body as literal bytes interleaved with image indexes"""
+        def literal(text):
+            return text.encode("utf-8")
+
+        segments = [literal('{"session_id": %s, ' % json.dumps(self.session_id))]
+        if self.stream:
+            segments.append(b'"stream": true, ')
+        segments.append(b'"user_message": {"type": "image", "image": [')
+        for i in range(len(self.images)):
+            if i:
+                segments.append(b", ")
+            segments.append(i)
+        segments.append(literal(
+            ']}, "conversation_history": [{"role": "user", "content": %s, "attachments": ['
+            % json.dumps(self.prompt)))
+        if self.use_references:
+            refs = [f"user_message.image[{i}]" for i in range(len(self.images))]
+            segments.append(literal('{"type": "file", "ref": %s}' % json.dumps(refs)))
+        else:
+            segments.append(b'{"type": "file", "base64String": [')
+            for i in range(len(self.images)):
+                if i:
+                    segments.append(b", ")
+                segments.append(i)
+            segments.append(b"]}")
+        segments.append(b"]}]}")
+        return segments
+
+    def __len__(self):
+        total = 0
+        for segment in self._segments():
+            if isinstance(segment, int):
+                total += 2 + 4 * ((len(self.images[segment]) + 2) // 3)
+            else:
+                total += len(segment)
+        return total
+
+    def iter_chunks(self):
+        for segment in self._segments():
+            if not isinstance(segment, int):
+                yield segment
+                continue
+            view = memoryview(self.images[segment])
+            yield b'"'
+            for start in range(0, len(view), self.CHUNK_SIZE):
+                yield base64.b64encode(view[start:start + self.CHUNK_SIZE])
+            yield b'"'
+
+    def open(self):
+        """A fresh streaming reader over the body (one per request attempt)"""
+        return PayloadReader(self.iter_chunks(), len(self))
+
+
+class PayloadReader:
+    """Minimal file-like wrapper so requests can stream a ChatPayload"""
+    def __init__(self, chunks, length):
+        self._chunks = chunks
+        self._buffer = b""
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class LatencyStats:
+    """Thread-safe rolling latency samples with percentile summaries"""
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, ms, ok=True):
+        with self._lock:
+            self.samples.append(ms)
+            self.count += 1
+            if not ok:
+                self.errors += 1
+
+    def percentile(self, pct):
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+        }
+
+    def describe(self):
+        p50, p99 = self.percentile(50), self.percentile(99)
+        if p50 is None:
+            return "no samples"
+        return f"p50 {p50:.0f} ms, p99 {p99:.0f} ms over {self.count}"
+
+
+class ChatClient:
+    """Reusable HTTP client for the /v1/chat backend.
+
+    Keeps a pooled keep-alive Session, applies connect and read timeouts so
+    a hung backend cannot block a capture forever, and retries connection
+    errors and 5xx responses with exponential backoff. Every attempt is
+    recorded in self.stats.
+    """
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, url="http://localhost:8001/v1/chat", connect_timeout=3.05,
+                 read_timeout=120, retries=2, backoff=0.5, pool_size=4):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = LatencyStats()
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def _send(self, payload, **kwargs):
+        """POST with retries; returns the response once it has a non-retryable status.
+
+        Raises requests.exceptions.RequestException once retries run out.
+        """
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                # Each attempt needs a fresh reader; the previous one is consumed
+                response = self.session.post(self.url, data=payload.open(), timeout=self.timeout, **kwargs)
+                if response.status_code in self.RETRY_STATUSES and attempt < self.retries:
+                    self.stats.record((time.perf_counter() - start) * 1000, ok=False)
+                    response.close()
+                else:
+                    response.raise_for_status()
+                    return response, start
+            except requests.exceptions.ConnectionError:
+                # Includes ConnectTimeout; read timeouts are not retried
+                self.stats.record((time.perf_counter() - start) * 1000, ok=False)
+                if attempt >= self.retries:
+                    raise
+            except requests.exceptions.RequestException:
+                self.stats.record((time.perf_counter() - start) * 1000, ok=False)
+                raise
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    def post(self, payload):
+        """POST a ChatPayload and return the decoded JSON response"""
+        response, start = self._send(payload)
+        try:
+            result = response.json()
+        except ValueError:
+            self.stats.record((time.perf_counter() - start) * 1000, ok=False)
+            raise
+        self.stats.record((time.perf_counter() - start) * 1000)
+        return result
+
+    def stream(self, payload):
+        """POST a ChatPayload and yield assistant text as it arrives.
+
+        Understands server-sent events ("data: {...}" lines ending with
+        "data: [DONE]"), newline-delimited JSON and plain chunked text. Each
+        JSON event contributes its "delta", "content" or "assistant_message"
+        field. A server that ignores streaming and answers with a single
+        JSON document yields its assistant_message once.
+        """
+        response, start = self._send(
+            payload,
+            stream=True,
+            headers={"Accept": "text/event-stream, application/x-ndjson, application/json"}
+        )
+        ok = False
+        try:
+            content_type = response.headers.get("Content-Type", "")
+            if "charset" not in content_type:
+                # requests would yield bytes for NDJSON and Latin-1 for text/*
+                response.encoding = "utf-8"
+            if content_type.startswith("application/json"):
+                yield response.json().get("assistant_message") or ""
+            elif content_type.startswith("text/plain"):
+                for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                    if chunk:
+                        yield chunk
+            else:
+                event_stream = content_type.startswith("text/event-stream")
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    if line.startswith("data:"):
+                        line = line[5:].strip()
+                    elif event_stream:
+                        continue  # event:, id:, retry: and comment lines
+                    if line == "[DONE]":
+                        break
+                    delta = self._event_text(line)
+                    if delta:
+                        yield delta
+            ok = True
+        finally:
+            response.close()
+            self.stats.record((time.perf_counter() - start) * 1000, ok=ok)
+
+    @staticmethod
+    def _event_text(line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return line
+        if isinstance(event, str):
+            return event
+        if isinstance(event, dict):
+            for field in ("delta", "content", "assistant_message"):
+                if isinstance(event.get(field), str):
+                    return event[field]
+        return ""
+
+    def close(self):
+        self.session.close()
+
+
+class CapturePipeline:
+    """Bounded worker pool that processes captures off the capture thread.
+
+    submit() returns as soon as the capture is queued, so grabbing the
+    pixels stays fast. At most max_pending captures may be queued or in
+    flight; beyond that submit() blocks, which is the backpressure. Results
+    are handed to deliver(item, result, error) in submission order even
+    when workers finish out of order.
+    """
+    def __init__(self, process, deliver, workers=2, max_pending=4):
+        self.process = process
+        self.deliver = deliver
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._next_delivery = 0
+        self._done = {}  # seq -> (item, result, error), waiting for earlier captures
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._run, name=f"capture-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def pending(self):
+        """Captures submitted but not yet delivered"""
+        with self._lock:
+            return self._next_seq - self._next_delivery
+
+    def submit(self, item, timeout=None):
+        """Queue an item; blocks while the pipeline is full. Returns False on timeout."""
+        if not self._slots.acquire(timeout=timeout):
+            return False
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+        self._queue.put((seq, item))
+        return True
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            seq, item = job
+            result, error = None, None
+            try:
+                result = self.process(item)
+            except Exception as e:
+                error = e
+            self._finish(seq, item, result, error)
+
+    def _finish(self, seq, item, result, error):
+        with self._lock:
+            self._done[seq] = (item, result, error)
+            while self._next_delivery in self._done:
+                ready = self._done.pop(self._next_delivery)
+                self._next_delivery += 1
+                self._slots.release()
+                try:
+                    self.deliver(*ready)
+                except Exception as e:
+                    print("Error delivering capture:", str(e))
+
+    def drain(self, timeout=None):
+        """Block until every submitted item has been delivered. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def shutdown(self):
+        for _ in self._workers:
+            self._queue.put(None)
+
+
+def batch_prompt(image_counts):
+    """CAPTURE_PROMPT for several screenshots, asking for one labelled answer each"""
+    lines = []
+    first = 1
+    for number, count in enumerate(image_counts, 1):
+        if count == 1:
+            lines.append(f"Screenshot {number}: image {first}")
+        else:
+            lines.append(f"Screenshot {number}: images {first}-{first + count - 1}")
+        first += count
+    return (
+        f"{CAPTURE_PROMPT}. The images belong to {len(image_counts)} separate screenshots:\n"
+        + "\n".join(lines)
+        + "\nAnswer for each screenshot separately, starting each answer with a "
+          "heading line \"## Screenshot <number>\"."
+    )
+
+
+def split_batch_response(text, count):
+    """Split a batched answer into count parts; None where a part is missing"""
+    parts = [None] * count
+    headings = list(BATCH_HEADING.finditer(text))
+    for i, match in enumerate(headings):
+        number = int(match.group(1))
+        if 1 <= number <= count and parts[number - 1] is None:
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+            parts[number - 1] = text[match.end():end].strip()
+    return parts
+
+
+class CaptureBatcher:
+    """Collect captures until max_items are queued or max_wait seconds pass.
+
+    flush(items) runs on the thread that added the last item when the
+    batch fills up, or on a timer thread when the window expires.
+    """
+    def __init__(self, flush, max_items=4, max_wait=10.0):
+        self.flush = flush
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self._items = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        """Queue an item; returns how many are now waiting (0 if it flushed)"""
+        with self._lock:
+            self._items.append(item)
+            if len(self._items) < self.max_items:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.max_wait, self.flush_now)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return len(self._items)
+        self.flush_now()
+        return 0
+
+    def flush_now(self):
+        with self._lock:
+            items, self._items = self._items, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if items:
+            self.flush(items)
+
+    def close(self):
+        """Send whatever is still waiting"""
+        self.flush_now()
+
+
+class ResponseCache:
+    """Persistent cache of assistant responses keyed by upload content.
+
+    A key is the SHA-256 of the prompt, the window title and the bytes of
+    every uploaded image; a byte-identical repeat is the fast path. With
+    near_cells set, a capture that misses is also compared with the last
+    few answered captures of the same window title, using FrameDiffer's
+    reduced grayscale fingerprint: if at most near_cells cells moved by
+    more than pixel_threshold, that capture's answer is reused. Entries
+    expire after ttl_seconds, are evicted LRU beyond max_entries and are
+    persisted as JSON in the cache directory with an atomic rename; the
+    fingerprints live only in memory.
+    """
+    def __init__(self, directory, max_entries=500, ttl_seconds=3600, near_cells=None,
+                 sample_step=4, pixel_threshold=8, near_per_title=16):
+        self.directory = directory
+        self.path = os.path.join(directory, "response_cache.json")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.near_cells = near_cells
+        self.near_per_title = near_per_title
+        self.differ = None
+        if near_cells is not None:
+            self.differ = FrameDiffer(sample_step=sample_step, pixel_threshold=pixel_threshold)
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> {"response", "created"}
+        self._similar = OrderedDict()  # title -> deque of (fingerprint, key), newest last
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(prompt, title, images):
+        digest = hashlib.sha256()
+        for part in (prompt.encode("utf-8"), title.encode("utf-8")) + tuple(images):
+            # Length prefixes keep ("ab", "c") and ("a", "bc") apart
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for record in records:
+            # Records without a key come from the old perceptual-hash cache
+            if "key" in record and now - record["created"] < self.ttl_seconds:
+                self._entries[record["key"]] = {
+                    "response": record["response"],
+                    "created": record["created"],
+                }
+
+    def _save(self):
+        records = [{"key": key, **value} for key, value in self._entries.items()]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(records, f)
+        os.replace(tmp_path, self.path)
+
+    def fingerprint(self, image):
+        """Near-duplicate fingerprint of a capture, or None when that lookup is off"""
+        return self.differ.fingerprint(image) if self.differ is not None else None
+
+    def _live(self, key):
+        """Caller holds the lock"""
+        value = self._entries.get(key)
+        if value is not None and time.time() - value["created"] >= self.ttl_seconds:
+            del self._entries[key]
+            value = None
+        return value
+
+    def get(self, key, title=None, fingerprint=None):
+        """Cached response for key, else for a near-duplicate of fingerprint; or None"""
+        with self._lock:
+            value = self._live(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value["response"]
+            candidates = list(self._similar.get(title, ())) if fingerprint is not None else []
+
+        for previous, similar_key in reversed(candidates):
+            changed = self.differ.changed_cells(previous, fingerprint)
+            if changed is None or changed > self.near_cells:
+                continue
+            with self._lock:
+                value = self._live(similar_key)
+                if value is not None:
+                    self._entries.move_to_end(similar_key)
+                    self.near_hits += 1
+                    return value["response"]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, response, title=None, fingerprint=None):
+        with self._lock:
+            self._entries[key] = {"response": response, "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if fingerprint is not None:
+                recent = self._similar.setdefault(title, deque(maxlen=self.near_per_title))
+                recent.append((fingerprint, key))
+                self._similar.move_to_end(title)
+                while len(self._similar) > self.max_entries:
+                    self._similar.popitem(last=False)
+            try:
+                self._save()
+            except OSError as e:
+                print("Could not persist response cache:", str(e))
+
+    def describe(self):
+        near = f" ({self.near_hits} near)" if self.near_hits else ""
+        return f"cache {self.hits + self.near_hits} hits{near} / {self.misses} misses"
+
+
+class FrameDiffer:
+    """Spot repeat captures of a window whose pixels have not changed.
+
+    Each grab is box-averaged down by sample_step (Image.reduce, so every
+    pixel contributes and a one-glyph edit still moves its cell) and
+    compared with the last frame of the same window title that was
+    processed; skipped frames never become the baseline, so slow
+    one-character-at-a-time edits still add up. A cell counts as changed
+    when it moved by more than pixel_threshold grayscale levels; the frame
+    counts as changed when more than min_changed of the cells did. With
+    the optional numpy package the changed cells are also grouped into
+    bounding boxes in full-size coordinates.
+    """
+    def __init__(self, sample_step=4, pixel_threshold=8, min_changed=0.0, max_titles=32):
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self.np = numpy
+        self.sample_step = max(1, sample_step)
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.max_titles = max_titles
+        self._previous = OrderedDict()  # title -> fingerprint
+        self._lock = threading.Lock()
+
+    def fingerprint(self, image):
+        return image.reduce(self.sample_step).convert("L")
+
+    def compare(self, title, image):
+        """Return (changed, changed_fraction, regions); changed frames become the baseline.
+
+        regions is a list of (left, top, right, bottom) boxes, empty when
+        nothing changed, the frame is the first for this title or numpy
+        is unavailable.
+        """
+        current = self.fingerprint(image)
+        with self._lock:
+            previous = self._previous.get(title)
+
+        result = self._compare(previous, current)
+        if result[0]:
+            with self._lock:
+                self._previous[title] = current
+                self._previous.move_to_end(title)
+                while len(self._previous) > self.max_titles:
+                    self._previous.popitem(last=False)
+        return result
+
+    def _compare(self, previous, current):
+        if previous is None or previous.size != current.size:
+            return True, 1.0, []
+
+        if self.np is None:
+            mask = ImageChops.difference(previous, current).point(
+                lambda v: 255 if v > self.pixel_threshold else 0
+            )
+            changed = mask.histogram()[255] / (current.size[0] * current.size[1])
+            return changed > self.min_changed, changed, []
+
+        np = self.np
+        height, width = current.size[1], current.size[0]
+        a = np.frombuffer(previous.tobytes(), dtype=np.uint8).reshape(height, width)
+        b = np.frombuffer(current.tobytes(), dtype=np.uint8).reshape(height, width)
+        mask = np.abs(a.astype(np.int16) - b) > self.pixel_threshold
+        changed = float(mask.mean())
+        if changed <= self.min_changed:
+            return False, changed, []
+        return True, changed, self._regions(mask)
+
+    def changed_cells(self, previous, current):
+        """Number of fingerprint cells that moved by more than pixel_threshold; None if sizes differ"""
+        if previous.size != current.size:
+            return None
+        mask = ImageChops.difference(previous, current).point(
+            lambda v: 255 if v > self.pixel_threshold else 0
+        )
+        return mask.histogram()[255]
+
+    def _regions(self, mask):
+        """Bounding boxes of horizontal bands of changed rows"""
+        np = self.np
+        step = self.sample_step
+        rows = mask.any(axis=1).astype(np.int8)
+        # Band edges are where a run of changed rows starts or stops
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], rows, [0]))))
+        regions = []
+        for top, bottom in zip(edges[::2], edges[1::2]):
+            columns = np.flatnonzero(mask[top:bottom].any(axis=0))
+            regions.append((
+                int(columns[0]) * step, int(top) * step,
+                (int(columns[-1]) + 1) * step, int(bottom) * step
+            ))
+        return regions
+
+    def forget(self, title):
+        with self._lock:
+            self._previous.pop(title, None)
+
+
+class PayloadJournal:
+    """Background, append-only journal of the payloads sent to the API.
+
+    record() only queues; a writer thread appends one compact JSON line per
+    request to journal.jsonl. Image bytes are written once to
+    images/<sha256>.<ext> (via a temp file and an atomic rename) and the
+    records reference them by hash, so a repeated image costs nothing.
+    Once the journal passes max_bytes it is renamed to
+    journal-<timestamp>.jsonl and only the newest max_files of those are
+    kept; images that no kept journal references are deleted at that point.
+    fsync is "always" (every record and image), "rotate" (when a file is
+    rotated or closed) or "never".
+    """
+    FSYNC_POLICIES = ("always", "rotate", "never")
+    IMAGE_EXTENSIONS = ((b"\x89PNG", "png"), (b"\xff\xd8", "jpg"), (b"RIFF", "webp"))
+
+    def __init__(self, directory, max_bytes=16 * 1024 * 1024, max_files=5, fsync="rotate",
+                 on_error=None):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"Unsupported fsync policy: {fsync}")
+        self.directory = directory
+        self.image_dir = os.path.join(directory, "images")
+        self.path = os.path.join(directory, "journal.jsonl")
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.fsync = fsync
+        self.on_error = on_error
+        os.makedirs(self.image_dir, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name="payload-journal", daemon=True)
+        self._writer.start()
+
+    def record(self, payload, **fields):
+        """Queue one request for the journal; extra fields go into the record"""
+        self._queue.put((time.time(), payload, fields))
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._write(*job)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(e)
+
+    def _store_image(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        extension = next((ext for magic, ext in self.IMAGE_EXTENSIONS if data.startswith(magic)), "bin")
+        name = f"{digest}.{extension}"
+        path = os.path.join(self.image_dir, name)
+        try:
+            os.utime(path)  # a repeat counts as recent for the storage quota
+        except FileNotFoundError:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                if self.fsync == "always":
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return name
+
+    def _write(self, created, payload, fields):
+        record = {
+            "time": datetime.fromtimestamp(created).isoformat(timespec="milliseconds"),
+            "session_id": payload.session_id,
+            "prompt": payload.prompt,
+            "stream": payload.stream,
+            "images": [self._store_image(data) for data in payload.images],
+        }
+        record.update(fields)
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        if self.fsync == "always":
+            os.fsync(self._file.fileno())
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+        self._file.close()
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        os.replace(self.path, os.path.join(self.directory, f"journal-{stamp}.jsonl"))
+        rotated = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith("journal-") and name.endswith(".jsonl")
+        )
+        for name in rotated[:-self.max_files] if self.max_files else rotated:
+            os.remove(os.path.join(self.directory, name))
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._prune_images(rotated[-self.max_files:] if self.max_files else [])
+
+    def _prune_images(self, journals):
+        """Delete images that none of the given journal files reference"""
+        referenced = set()
+        for name in journals:
+            with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        referenced.update(json.loads(line).get("images", ()))
+                    except ValueError:
+                        continue  # torn last line of a crashed session
+        for name in os.listdir(self.image_dir):
+            if name not in referenced:
+                try:
+                    os.remove(os.path.join(self.image_dir, name))
+                except OSError:
+                    pass
+
+    def close(self):
+        """Write everything still queued, then close the journal"""
+        self._queue.put(None)
+        self._writer.join()
+        if self.fsync != "never":
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+
+class TempStorageManager:
+    """Keep the app's temp directories under a size and an age quota.
+
+    Every launch gets its own <prefix><timestamp> directory under root.
+    A low-priority daemon thread periodically scans all of them. It first
+    deletes files older than max_age seconds, then deletes the oldest
+    remaining files until the total is under max_bytes, and finally
+    removes emptied directories. Directories in protect (the running
+    session's) are counted but never cleaned. Fixed directories in paths
+    are managed the same way, except that they are never removed
+    themselves; root may be None to manage only those.
+    """
+    def __init__(self, root, prefix="es_screenshots_", max_bytes=512 * 1024 * 1024,
+                 max_age=24 * 3600, interval=600, protect=(), paths=(), on_cleanup=None):
+        self.root = root
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.protect = {os.path.abspath(path) for path in protect}
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.on_cleanup = on_cleanup
+        self.last_usage = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def directories(self):
+        directories = [path for path in self.paths if os.path.isdir(path)]
+        if self.root is None:
+            return directories
+        try:
+            with os.scandir(self.root) as it:
+                return directories + [
+                    entry.path for entry in it
+                    if entry.name.startswith(self.prefix) and entry.is_dir(follow_symlinks=False)
+                ]
+        except OSError:
+            return directories
+
+    def _scan_files(self, directory):
+        """(mtime, size, path) of every file below directory"""
+        files = []
+        stack = [directory]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            else:
+                                stat = entry.stat(follow_symlinks=False)
+                                files.append((stat.st_mtime, stat.st_size, entry.path))
+                        except OSError:
+                            continue  # removed while we looked
+            except OSError:
+                continue
+        return files
+
+    def usage(self):
+        """Current totals across all matching directories"""
+        directories = self.directories()
+        files = [f for directory in directories for f in self._scan_files(directory)]
+        self.last_usage = {
+            "directories": len(directories),
+            "files": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+        }
+        return self.last_usage
+
+    def describe(self):
+        usage = self.last_usage or self.usage()
+        mb = 1024 * 1024
+        return (f"{usage['bytes'] / mb:.1f}/{usage['max_bytes'] / mb:.0f} MB in "
+                f"{usage['files']} files, {usage['directories']} directories")
+
+    def enforce(self):
+        """One cleanup pass; returns (files removed, bytes freed)"""
+        protected_bytes = 0
+        candidates = []
+        directories = self.directories()
+        for directory in directories:
+            files = self._scan_files(directory)
+            if os.path.abspath(directory) in self.protect:
+                protected_bytes += sum(size for _, size, _ in files)
+            else:
+                candidates.extend(files)
+        candidates.sort()  # oldest first
+
+        total = protected_bytes + sum(size for _, size, _ in candidates)
+        cutoff = time.time() - self.max_age
+        removed, freed = 0, 0
+        for mtime, size, path in candidates:
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            freed += size
+            total -= size
+            if removed % 200 == 0:
+                time.sleep(0)  # let the capture threads run
+
+        for directory in directories:
+            if os.path.abspath(directory) not in self.protect:
+                self._remove_empty(directory)
+        self.usage()
+        return removed, freed
+
+    def _remove_empty(self, directory):
+        keep = os.path.abspath(directory) in self.paths
+        for parent, _, _ in sorted(os.walk(directory), key=lambda item: len(item[0]), reverse=True):
+            if keep and os.path.abspath(parent) == os.path.abspath(directory):
+                continue
+            try:
+                os.rmdir(parent)
+            except OSError:
+                pass  # not empty
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="temp-cleanup", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            # Linux schedules threads individually, so this lowers only this one
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.is_set():
+            try:
+                removed, freed = self.enforce()
+                if removed and self.on_cleanup is not None:
+                    self.on_cleanup(removed, freed)
+            except Exception as e:
+                print("Temp cleanup failed:", str(e))
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+
+
+class CaptureArchive:
+    """Persistent capture history: a SQLite index plus content-addressed images.
+
+    Each capture is one row (title, time, image hash, file path, backend,
+    response). Responses and titles are indexed with FTS5 where SQLite
+    has it, with a LIKE scan as the fallback. Full-resolution images are
+    stored once under images/<hash[:2]>/<hash>.<ext>, so identical
+    captures share a file. Paths are stored relative to the archive
+    directory. Reading recent rows touches only the index, never an image.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS captures (
+            id TEXT PRIMARY KEY,
+            captured_at TEXT NOT NULL,
+            title TEXT NOT NULL,
+            image_hash TEXT NOT NULL,
+            image_path TEXT NOT NULL,
+            backend TEXT,
+            response TEXT
+        );
+        CREATE INDEX IF NOT EXISTS captures_by_time ON captures (captured_at);
+    """
+    FTS_SCHEMA = """
+        CREATE VIRTUAL TABLE IF NOT EXISTS captures_fts USING fts5(
+            title, response, content='captures', content_rowid='rowid'
+        );
+        CREATE TRIGGER IF NOT EXISTS captures_ai AFTER INSERT ON captures BEGIN
+            INSERT INTO captures_fts (rowid, title, response)
+            VALUES (new.rowid, new.title, new.response);
+        END;
+        CREATE TRIGGER IF NOT EXISTS captures_ad AFTER DELETE ON captures BEGIN
+            INSERT INTO captures_fts (captures_fts, rowid, title, response)
+            VALUES ('delete', old.rowid, old.title, old.response);
+        END;
+        CREATE TRIGGER IF NOT EXISTS captures_au AFTER UPDATE ON captures BEGIN
+            INSERT INTO captures_fts (captures_fts, rowid, title, response)
+            VALUES ('delete', old.rowid, old.title, old.response);
+            INSERT INTO captures_fts (rowid, title, response)
+            VALUES (new.rowid, new.title, new.response);
+        END;
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.image_dir = os.path.join(directory, "images")
+        os.makedirs(self.image_dir, exist_ok=True)
+        # Pipeline workers write and the UI thread reads; one connection behind a lock
+        self._db = sqlite3.connect(os.path.join(directory, "archive.sqlite3"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(self.SCHEMA)
+            try:
+                self._db.executescript(self.FTS_SCHEMA)
+                self.full_text = True
+            except sqlite3.OperationalError:  # SQLite built without FTS5
+                self.full_text = False
+
+    def store_image(self, data, extension):
+        """Write image bytes under their SHA-256 once; returns (hash, absolute path)"""
+        digest = hashlib.sha256(data).hexdigest()
+        folder = os.path.join(self.image_dir, digest[:2])
+        path = os.path.join(folder, f"{digest}.{extension}")
+        try:
+            os.utime(path)  # a repeat counts as recent for the storage quota
+        except FileNotFoundError:
+            os.makedirs(folder, exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest, path
+
+    def add(self, entry):
+        """Index a finished capture (its image must already be stored)"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO captures "
+                "(id, captured_at, title, image_hash, image_path, backend, response) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    entry["id"],
+                    entry["captured_at"].isoformat(),
+                    entry["title"],
+                    entry["image_hash"],
+                    os.path.relpath(entry["path"], self.directory),
+                    entry.get("backend"),
+                    entry.get("api_response"),
+                )
+            )
+
+    def _entry(self, row):
+        captured_at = datetime.fromisoformat(row["captured_at"])
+        return {
+            "id": row["id"],
+            "image": None,  # decoded lazily from path
+            "title": row["title"],
+            "timestamp": captured_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "captured_at": captured_at,
+            "path": os.path.join(self.directory, row["image_path"]),
+            "image_hash": row["image_hash"],
+            "backend": row["backend"],
+            "payload_json": None,
+            "api_response": row["response"],
+        }
+
+    def recent(self, limit=20):
+        """The newest captures as history entries, newest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM captures ORDER BY captured_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def search(self, text, limit=50):
+        """Captures whose title or response matches text, best matches first"""
+        with self._lock:
+            if self.full_text:
+                # Quote every word so user input can't break the FTS query syntax
+                query = " ".join('"%s"' % word.replace('"', '""') for word in text.split())
+                if not query:
+                    return []
+                rows = self._db.execute(
+                    "SELECT captures.* FROM captures_fts "
+                    "JOIN captures ON captures.rowid = captures_fts.rowid "
+                    "WHERE captures_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (query, limit)
+                ).fetchall()
+            else:
+                pattern = f"%{text}%"
+                rows = self._db.execute(
+                    "SELECT * FROM captures WHERE title LIKE ? OR response LIKE ? "
+                    "ORDER BY captured_at DESC LIMIT ?",
+                    (pattern, pattern, limit)
+                ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def make_thumbnail(image, width=600):
+    """Scale image down to width: a cheap box reduce, then LANCZOS on the rest"""
+    ratio = min(width / image.size[0], 1.0)
+    size = (max(int(image.size[0] * ratio), 1), max(int(image.size[1] * ratio), 1))
+    # Integer reduce to about twice the target keeps the LANCZOS pass small
+    factor = min(image.size[0] // (size[0] * 2), image.size[1] // (size[1] * 2))
+    if factor > 1:
+        image = image.reduce(factor)
+    return image.resize(size, Image.LANCZOS)
+
+
+class ThumbnailCache:
+    """Card thumbnails, made once per image and kept in memory and on disk.
+
+    Thumbnails are keyed by the archive's image hash and stored as JPEG
+    under <directory>/<hash[:2]>/<hash>_<width>.jpg. request() never
+    blocks: a background thread loads the disk copy, or decodes the full
+    image once to make it, then hands the thumbnail to the callback.
+    """
+    def __init__(self, directory, width=600, max_entries=256):
+        self.directory = directory
+        self.width = width
+        self.max_entries = max_entries
+        self._memory = OrderedDict()  # image hash -> thumbnail
+        self._pending = {}  # image hash -> callbacks waiting for it
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+        self._worker.start()
+
+    def path(self, image_hash):
+        return os.path.join(self.directory, image_hash[:2], f"{image_hash}_{self.width}.jpg")
+
+    def get(self, image_hash):
+        """The in-memory thumbnail, or None"""
+        with self._lock:
+            thumbnail = self._memory.get(image_hash)
+            if thumbnail is not None:
+                self._memory.move_to_end(image_hash)
+            return thumbnail
+
+    def _remember(self, image_hash, thumbnail):
+        with self._lock:
+            self._memory[image_hash] = thumbnail
+            self._memory.move_to_end(image_hash)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def create(self, image_hash, image):
+        """Make, cache and persist the thumbnail of an image already in memory"""
+        thumbnail = make_thumbnail(image, self.width)
+        self._remember(image_hash, thumbnail)
+        path = self.path(image_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        thumbnail.convert("RGB").save(tmp_path, format="JPEG", quality=85)
+        os.replace(tmp_path, path)
+        return thumbnail
+
+    def load(self, image_hash, image_path):
+        """Memory, then disk, then the full image as a last resort"""
+        thumbnail = self.get(image_hash)
+        if thumbnail is not None:
+            return thumbnail
+        try:
+            with Image.open(self.path(image_hash)) as img:
+                img.load()
+            self._remember(image_hash, img)
+            return img
+        except OSError:
+            pass
+        with Image.open(image_path) as img:
+            # JPEG archives decode straight at a fraction of the size
+            img.draft("RGB", (self.width, self.width * img.size[1] // img.size[0]))
+            img.load()
+            return self.create(image_hash, img)
+
+    def request(self, image_hash, image_path, callback):
+        """Load a thumbnail in the background; callback(thumbnail or None) runs on the worker"""
+        with self._lock:
+            waiting = self._pending.setdefault(image_hash, [])
+            waiting.append(callback)
+            if len(waiting) > 1:
+                return
+        self._queue.put((image_hash, image_path))
+
+    def _run(self):
+        while True:
+            image_hash, image_path = self._queue.get()
+            try:
+                thumbnail = self.load(image_hash, image_path)
+            except Exception as e:
+                print("Could not load thumbnail:", str(e))
+                thumbnail = None
+            with self._lock:
+                callbacks = self._pending.pop(image_hash, [])
+            for callback in callbacks:
+                callback(thumbnail)
+
+
+def load_settings(path):
+    """DEFAULT_SETTINGS overridden by the JSON file at path, if it exists"""
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                settings.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print("Could not read settings:", str(e))
+    return settings
+
+
+class CaptureProcessor:
+    """Encode, upload, cache and archive captures; everything but the UI.
+
+    ScreenshotApp runs it on its pipeline workers and HeadlessRunner on
+    its own, so both share one capture -> compress -> chat path. Streamed
+    responses go to stream_handler(payload, entry), which by default just
+    collects the text.
+    """
+    def __init__(self, settings, script_dir, stream_handler=None, make_thumbnails=True, on_error=None,
+                 on_cleanup=None):
+        self.settings = settings
+        self.script_dir = script_dir
+        self.stream_handler = stream_handler or self.collect_stream
+        self.batch_session_id = str(uuid.uuid4())
+
+        self.encoder = ImageEncoder(
+            upload_format=self.settings["upload_format"],
+            upload_quality=self.settings["upload_quality"],
+            max_size=self.settings["upload_max_size"],
+            archive_format=self.settings["archive_format"]
+        )
+
+        self.chat_client = ChatClient(
+            url=self.settings["api_url"],
+            connect_timeout=self.settings["api_connect_timeout"],
+            read_timeout=self.settings["api_read_timeout"],
+            retries=self.settings["api_retries"],
+            backoff=self.settings["api_backoff"],
+            pool_size=max(4, self.settings["pipeline_workers"])
+        )
+
+        self.journal = PayloadJournal(
+            self.settings["journal_dir"] or os.path.join(self.script_dir, "payload_journal"),
+            max_bytes=self.settings["journal_max_mb"] * 1024 * 1024,
+            max_files=self.settings["journal_max_files"],
+            fsync=self.settings["journal_fsync"],
+            on_error=on_error
+        )
+
+        self.frame_differ = None
+        if self.settings["skip_unchanged"]:
+            self.frame_differ = FrameDiffer(
+                sample_step=self.settings["diff_sample_step"],
+                pixel_threshold=self.settings["diff_pixel_threshold"],
+                min_changed=self.settings["diff_min_changed"]
+            )
+
+        self.region_selector = RegionSelector(
+            templates=self.settings["roi_templates"],
+            detect_text=self.settings["roi_detect_text"],
+            max_regions=self.settings["roi_max_regions"]
+        )
+
+        self.response_cache = None
+        if self.settings["response_cache"]:
+            self.response_cache = ResponseCache(
+                self.settings["response_cache_dir"] or os.path.join(tempfile.gettempdir(), "es_response_cache"),
+                max_entries=self.settings["response_cache_entries"],
+                ttl_seconds=self.settings["response_cache_ttl"],
+                near_cells=self.settings["response_cache_near_cells"],
+                sample_step=self.settings["diff_sample_step"],
+                pixel_threshold=self.settings["diff_pixel_threshold"]
+            )
+
+        self.archive = CaptureArchive(
+            self.settings["archive_dir"] or os.path.join(self.script_dir, "capture_archive")
+        )
+        self.thumbnails = None
+        if make_thumbnails:
+            self.thumbnails = ThumbnailCache(
+                os.path.join(self.archive.directory, "thumbnails"),
+                width=self.settings["thumbnail_width"]
+            )
+
+        # Archived and journaled images accumulate across sessions; the caller
+        # starts this once its on_cleanup can run. Index rows and journal
+        # records outlive the images they name, so their text stays searchable.
+        self.storage = TempStorageManager(
+            None,
+            max_bytes=int(self.settings["storage_max_mb"] * 1024 * 1024),
+            max_age=self.settings["storage_max_age_days"] * 24 * 3600,
+            interval=self.settings["temp_cleanup_interval"],
+            paths=[
+                self.archive.image_dir,
+                os.path.join(self.archive.directory, "thumbnails"),
+                self.journal.image_dir,
+            ],
+            on_cleanup=on_cleanup
+        )
+
+    def grab(self, backends, region=None, exclude_title=None):
+        """Grab region, or the active window, as a pipeline item.
+
+        The active window is grabbed by its bounds, else as the foreground
+        window, else as the full screen. Returns (capture, None), or
+        (None, reason) when there is nothing to send: no usable window (an
+        empty title, or one containing exclude_title), or pixels unchanged
+        since the window's last processed frame. Raises RuntimeError when
+        no backend can grab and ValueError for empty window bounds.
+        """
+        if region is not None:
+            grab_backend, screenshot = backends.call("grab", *region)
+            title = "Region {},{} {}x{}".format(*region)
+            capture_type = "region"
+            backend = grab_backend
+        else:
+            try:
+                _, (title, bounds) = backends.call("window_info")
+            except RuntimeError:
+                title, bounds = f"Window_{datetime.now().strftime('%H%M%S')}", None
+            if not title or (exclude_title and exclude_title in title):
+                return None, "No active window detected or captured our own app"
+            if bounds:
+                x, y, width, height = bounds
+                if width <= 0 or height <= 0:
+                    raise ValueError("Invalid window dimensions detected")
+                grab_backend, screenshot = backends.call("grab", x, y, width, height)
+                capture_type = "active window"
+            else:
+                try:
+                    grab_backend, screenshot = backends.call("window_grab")
+                    capture_type = "active window"
+                except RuntimeError:
+                    grab_backend, screenshot = backends.call("screen")
+                    capture_type = "full screen (fallback)"
+            backend = f"{backends.last_used.get('window_info')}/{grab_backend}"
+
+        regions = []
+        if self.frame_differ is not None:
+            changed, changed_fraction, regions = self.frame_differ.compare(title, screenshot)
+            if not changed:
+                return None, (f"No change since the last capture of {title} "
+                              f"({changed_fraction:.2%} of pixels differ); skipped upload")
+        return {
+            "id": str(uuid.uuid4()),
+            "image": screenshot,
+            "source": backend,
+            "title": title,
+            "capture_type": capture_type,
+            "backend": backend,
+            "captured_at": datetime.now(),
+            "changed_regions": regions
+        }, None
+
+    def prepare_capture(self, capture):
+        """Archive and encode one capture; returns (entry, uploads, image hashes)"""
+        screenshot = capture["image"]
+        window_title = capture["title"]
+        
+        # One encode for the archival copy, one per uploaded image; no decode round-trip
+        image_hash, file_path = self.archive.store_image(
+            self.encoder.encode_archive(screenshot), self.encoder.archive_extension
+        )
+        regions = self.region_selector.select(window_title, screenshot)
+        if regions:
+            # Crops go up at native resolution so small text stays legible
+            uploads = [
+                self.encoder.encode_upload(screenshot.crop(box), self.settings["roi_max_size"])
+                for box in regions
+            ]
+        else:
+            uploads = [self.encoder.encode_upload(screenshot)]
+        if self.thumbnails is not None:
+            # Cached (memory LRU and disk) for the card; never kept on the entry
+            self.thumbnails.create(image_hash, screenshot)
+        
+        entry = {
+            "id": capture["id"],
+            "image": screenshot,
+            "title": window_title,
+            "timestamp": capture["captured_at"].strftime("%H:%M:%S"),
+            "captured_at": capture["captured_at"],
+            "path": file_path,
+            "image_hash": image_hash,
+            "backend": capture["backend"],
+            "changed_regions": capture.get("changed_regions", []),
+            "upload_regions": regions,
+            "payload_json": None,
+            "api_response": None
+        }
+        
+        # Repeat (or near-duplicate) of a recent capture: reuse its answer instead of uploading
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = ResponseCache.key(CAPTURE_PROMPT, window_title, [encoded.data for encoded in uploads])
+            # Kept only until finish_capture, which files it with the fresh answer
+            entry["cache_fingerprint"] = self.response_cache.fingerprint(screenshot)
+            cached = self.response_cache.get(cache_key, window_title, entry["cache_fingerprint"])
+            if cached is not None:
+                entry["api_response"] = cached
+                entry["cache_hit"] = True
+        
+        return entry, uploads, cache_key
+    
+    def finish_capture(self, entry, cache_key):
+        """Archive the capture; cache a fresh answer, or forget the window's frame if the upload failed"""
+        self.archive.add(entry)
+        fingerprint = entry.pop("cache_fingerprint", None)
+        if entry.get("cache_hit"):
+            return
+        # Only a real server answer is cached; stream handlers flag failures
+        # whose entry still carries placeholder or partial text
+        if entry["api_response"] and not entry.get("api_failed"):
+            if self.response_cache is not None and not entry.get("batch_unsplit"):
+                self.response_cache.put(cache_key, entry["api_response"], entry["title"], fingerprint)
+        elif self.frame_differ is not None:
+            # A failed upload must not make the next identical capture look redundant
+            self.frame_differ.forget(entry["title"])
+    
+    def process_item(self, item):
+        """Pipeline worker entry point: one capture or one batch of them"""
+        if "captures" in item:
+            return self.process_batch(item["captures"])
+        return self.process_capture(item)
+    
+    def process_capture(self, capture):
+        """Encode, upload and persist one capture (runs on a pipeline worker)"""
+        entry, uploads, cache_key = self.prepare_capture(capture)
+        
+        # The payload keeps the encoded bytes once and streams the JSON body
+        payload = ChatPayload(
+            [encoded.data for encoded in uploads],
+            CAPTURE_PROMPT,
+            use_references=self.settings["payload_image_refs"],
+            stream=self.settings["api_stream"]
+        )
+        entry["payload_json"] = payload
+        
+        if entry.get("cache_hit"):
+            pass
+        elif payload.stream:
+            self.stream_handler(payload, entry)
+        else:
+            entry["api_response"] = self.make_api_call(payload)
+        
+        self.finish_capture(entry, cache_key)
+        if not entry.get("cache_hit"):
+            # Nothing was sent for a cache hit, so there is no request to journal
+            self.journal.record(
+                payload,
+                captures=[entry["id"]],
+                titles=[entry["title"]],
+                responses=[entry["api_response"]]
+            )
+        
+        return entry
+    
+    def process_batch(self, captures):
+        """Send several captures in one request and split the answer per capture.
+
+        Cache hits are answered locally and left out of the request. Batches
+        reuse one session id, and are never streamed since the split needs
+        the whole answer.
+        """
+        prepared = [self.prepare_capture(capture) for capture in captures]
+        pending = [(entry, uploads) for entry, uploads, _ in prepared if not entry.get("cache_hit")]
+        
+        if pending:
+            payload = ChatPayload(
+                [encoded.data for _, uploads in pending for encoded in uploads],
+                batch_prompt([len(uploads) for _, uploads in pending]),
+                session_id=self.batch_session_id,
+                use_references=self.settings["payload_image_refs"]
+            )
+            response = self.make_api_call(payload)
+            answers = split_batch_response(response, len(pending)) if response else [None] * len(pending)
+            for (entry, _), answer in zip(pending, answers):
+                entry["payload_json"] = payload
+                # An answer the model did not label still beats no answer
+                entry["api_response"] = answer if answer is not None else response
+                entry["batch_unsplit"] = answer is None
+            self.journal.record(
+                payload,
+                captures=[entry["id"] for entry, _ in pending],
+                titles=[entry["title"] for entry, _ in pending],
+                responses=[entry["api_response"] for entry, _ in pending]
+            )
+        
+        for entry, _, cache_key in prepared:
+            self.finish_capture(entry, cache_key)
+        return [entry for entry, _, _ in prepared]
+    
+    def collect_stream(self, payload, entry):
+        """Default stream handler: gather the deltas without showing them"""
+        parts = []
+        try:
+            for delta in self.chat_client.stream(payload):
+                parts.append(delta)
+        except requests.exceptions.RequestException as e:
+            print("The error is:", str(e))
+            entry["api_failed"] = True  # the parts so far are not a whole answer
+        entry["api_response"] = "".join(parts) or None
+    
+    def make_api_call(self, payload):
+        try:
+            return self.chat_client.post(payload).get("assistant_message")
+
+        except requests.exceptions.RequestException as e:
+            print("The error is:", str(e))
+            return None
+
+    def close(self):
+        self.storage.stop()
+        self.chat_client.close()
+        self.journal.close()
+        self.archive.close()
+
+
+IMAGE_FILE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+
+class HeadlessRunner:
+    """The capture -> compress -> chat pipeline without Tk.
+
+    Captures come from the screen (on a schedule, or one per line read
+    from stdin) or from existing image files. Up to pipeline_workers of
+    them are encoded and uploaded at once, and one JSON line per capture
+    is written to output in submission order.
+    """
+    def __init__(self, settings, script_dir, output):
+        self.settings = settings
+        self.output = output
+        self.processor = CaptureProcessor(settings, script_dir, make_thumbnails=False,
+                                          on_error=self.on_journal_error, on_cleanup=self.on_cleanup)
+        self.processor.storage.start()
+        workers = settings["pipeline_workers"]
+        self.pipeline = CapturePipeline(self.process, self.write_result,
+                                        workers=workers, max_pending=workers * 2)
+        self.stats = LatencyStats()
+        self.backends = None
+
+    def on_journal_error(self, error):
+        print("Error saving payload:", str(error), file=sys.stderr)
+
+    def on_cleanup(self, removed, freed):
+        print(f"Removed {removed} old archived files ({freed / (1024 * 1024):.1f} MB); "
+              f"{self.processor.storage.describe()}", file=sys.stderr)
+
+    def process(self, capture):
+        start = time.perf_counter()
+        if capture["image"] is None:
+            # Files are only looked at here, so a bad path costs one error record
+            capture["captured_at"] = datetime.fromtimestamp(os.path.getmtime(capture["source"]))
+            with Image.open(capture["source"]) as img:
+                img.load()
+                capture["image"] = img
+        entry = self.processor.process_capture(capture)
+        entry["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        return entry
+
+    def write_result(self, capture, entry, error):
+        """Pipeline delivery callback: one JSON line per capture"""
+        record = {
+            "id": capture["id"],
+            "source": capture["source"],
+            "title": capture["title"],
+            "captured_at": capture["captured_at"].isoformat() if capture["captured_at"] else None,
+        }
+        if error is not None:
+            record["error"] = str(error)
+            self.stats.record(0, ok=False)
+        else:
+            record.update({
+                "image_path": entry["path"],
+                "image_hash": entry["image_hash"],
+                "upload_regions": entry["upload_regions"],
+                "cache_hit": bool(entry.get("cache_hit")),
+                "elapsed_ms": round(entry["elapsed_ms"], 1),
+                "response": entry["api_response"],
+            })
+            self.stats.record(entry["elapsed_ms"], ok=entry["api_response"] is not None)
+        capture["image"] = None
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+
+    def wait(self):
+        """Block until every submitted capture has been written"""
+        self.pipeline.drain()
+
+    def ingest(self, paths, recursive=False):
+        """Submit existing image files (and images inside directories)"""
+        for path in paths:
+            if os.path.isdir(path):
+                if recursive:
+                    files = [os.path.join(parent, name)
+                             for parent, _, names in os.walk(path) for name in names]
+                else:
+                    files = [os.path.join(path, name) for name in os.listdir(path)]
+                files = sorted(f for f in files if f.lower().endswith(IMAGE_FILE_EXTENSIONS))
+            else:
+                files = [path]
+            for file_path in files:
+                self.pipeline.submit({
+                    "id": str(uuid.uuid4()),
+                    "image": None,  # decoded on the worker
+                    "source": file_path,
+                    "title": os.path.basename(file_path),
+                    "backend": "file",
+                    "captured_at": None  # the file's mtime, read on the worker
+                })
+        self.wait()
+
+    def capture(self, interval=None, count=None, region=None):
+        """Capture every interval seconds, or once per stdin line without one"""
+        self.backends = default_backends()
+        self.backends.probe()
+        print(f"Backends: {self.backends.describe()}", file=sys.stderr)
+        triggers = iter(sys.stdin.readline, "") if interval is None else cycle([None])
+        taken = 0
+        try:
+            for _ in triggers:
+                if count is not None and taken >= count:
+                    break
+                started = time.monotonic()
+                try:
+                    capture, skipped = self.processor.grab(self.backends, region)
+                    if skipped:
+                        print(skipped, file=sys.stderr)
+                except Exception as e:
+                    print(f"Error capturing screenshot: {str(e)}", file=sys.stderr)
+                    capture = None
+                taken += 1
+                if capture is not None:
+                    self.pipeline.submit(capture)
+                if interval is not None:
+                    time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            pass
+        self.wait()
+
+    def close(self):
+        # Whatever was submitted before an error still gets its line
+        self.pipeline.drain()
+        self.pipeline.shutdown()
+        self.processor.close()
+        if self.backends is not None:
+            print("Backend metrics:", json.dumps(self.backends.metrics()))
+            self.backends.close()
+
+
+def search_archive(settings, script_dir, text, limit, output):
+    """Write one JSON line per archived capture matching text, best matches first"""
+    archive = CaptureArchive(settings["archive_dir"] or os.path.join(script_dir, "capture_archive"))
+    try:
+        entries = archive.search(text, limit)
+    finally:
+        archive.close()
+    for entry in entries:
+        output.write(json.dumps({
+            "id": entry["id"],
+            "captured_at": entry["captured_at"].isoformat(),
+            "title": entry["title"],
+            "image_path": entry["path"],
+            "image_hash": entry["image_hash"],
+            "backend": entry["backend"],
+            "response": entry["api_response"],
+        }) + "\n")
+    output.flush()
+    print(f"{len(entries)} matches ({'full-text' if archive.full_text else 'substring'} search)",
+          file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Capture screenshots and send them to the chat API without a GUI."
+    )
+    parser.add_argument("--settings", help="settings JSON (default: settings.json next to this script)")
+    parser.add_argument("--workers", type=int, help="captures processed in parallel (default: pipeline_workers)")
+    parser.add_argument("-o", "--output", help="JSONL results file, appended to (default: stdout)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="send existing image files or directories of them")
+    ingest.add_argument("paths", nargs="+")
+    ingest.add_argument("-r", "--recursive", action="store_true", help="descend into subdirectories")
+
+    capture = commands.add_parser("capture", help="capture the active window or a fixed region")
+    capture.add_argument("--interval", type=float,
+                         help="seconds between captures; without it, capture once per line on stdin")
+    capture.add_argument("--count", type=int, help="stop after this many captures")
+    capture.add_argument("--region", help="x,y,width,height instead of the active window")
+
+    search = commands.add_parser("search", help="find archived captures by title or response text")
+    search.add_argument("text")
+    search.add_argument("--limit", type=int, default=50)
+
+    args = parser.parse_args(argv)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    settings = load_settings(args.settings or os.path.join(script_dir, "settings.json"))
+    if args.workers:
+        settings["pipeline_workers"] = args.workers
+    region = None
+    if args.command == "capture" and args.region:
+        try:
+            region = tuple(int(v) for v in args.region.split(","))
+        except ValueError:
+            region = ()
+        if len(region) != 4:
+            parser.error("--region must be x,y,width,height")
+
+    # Only a file we opened is ours to close; stdout belongs to the process
+    close_output = bool(args.output)
+    output = open(args.output, "a", encoding="utf-8") if close_output else sys.stdout
+    if args.command == "search":
+        try:
+            search_archive(settings, script_dir, args.text, args.limit, output)
+        finally:
+            if close_output:
+                output.close()
+        return 0
+    # Diagnostics go to stderr so stdout stays valid JSONL
+    with contextlib.redirect_stdout(sys.stderr):
+        runner = HeadlessRunner(settings, script_dir, output)
+        start = time.perf_counter()
+        try:
+            if args.command == "ingest":
+                runner.ingest(args.paths, recursive=args.recursive)
+            else:
+                runner.capture(interval=args.interval, count=args.count, region=region)
+        finally:
+            runner.close()
+            if close_output:
+                output.close()
+        elapsed = time.perf_counter() - start
+        summary = runner.stats.summary()
+        print(f"{summary['count']} captures ({summary['errors']} failed) in {elapsed:.1f} s; "
+              f"{runner.stats.describe()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
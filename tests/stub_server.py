@@ -0,0 +1,78 @@
+"""A scripted /v1/chat stand-in on http.server for the client tests"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append(json.loads(body))
+        with self.server.lock:
+            action = self.server.script.pop(0) if self.server.script else self.server.default
+        action(self)
+
+    def send_body(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunks(self, chunks, content_type, delay=0.0):
+        """Chunked transfer encoding, flushed piece by piece"""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            data = chunk.encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+            time.sleep(delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def reply(status, body, content_type="application/json"):
+    return lambda handler: handler.send_body(status, body, content_type)
+
+
+def stall(seconds, then=None):
+    def action(handler):
+        time.sleep(seconds)
+        (then or reply(200, {"assistant_message": "late"}))(handler)
+    return action
+
+
+def chunks(pieces, content_type, delay=0.0):
+    return lambda handler: handler.send_chunks(pieces, content_type, delay)
+
+
+class StubServer:
+    """Serve actions from script in order, then default, on a free local port"""
+    def __init__(self, *script, default=None):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.block_on_close = False
+        self.server.script = list(script)
+        self.server.default = default or reply(200, {"assistant_message": "ok"})
+        self.server.requests = []
+        self.server.lock = threading.Lock()
+        self.url = "http://127.0.0.1:%d/v1/chat" % self.server.server_address[1]
+        self.requests = self.server.requests
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
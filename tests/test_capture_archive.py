@@ -0,0 +1,81 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_core import CaptureArchive, main
+
+CAPTURES = [
+    ("Inspection Report 1", "Minor oil seepage around the rear main seal."),
+    ("Inspection Report 2", "Timing belt replaced; coolant hose worn."),
+    ("Browser", "Nothing relevant here."),
+]
+
+
+class CaptureArchiveSearchTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.archive_dir = os.path.join(self.directory.name, "archive")
+        archive = CaptureArchive(self.archive_dir)
+        start = datetime(2026, 1, 1, 8, 0)
+        for i, (title, response) in enumerate(CAPTURES):
+            image_hash, path = archive.store_image(b"\x89PNG %d" % i, "png")
+            archive.add({
+                "id": f"capture-{i}",
+                "captured_at": start + timedelta(minutes=i),
+                "title": title,
+                "image_hash": image_hash,
+                "path": path,
+                "backend": "test",
+                "api_response": response,
+            })
+        archive.close()
+
+    def _search(self, text, full_text=True):
+        archive = CaptureArchive(self.archive_dir)
+        self.addCleanup(archive.close)
+        if not full_text:
+            archive.full_text = False  # as on an SQLite built without FTS5
+        return [entry["id"] for entry in archive.search(text)]
+
+    def test_full_text_search(self):
+        archive = CaptureArchive(self.archive_dir)
+        full_text = archive.full_text
+        archive.close()
+        if not full_text:
+            self.skipTest("SQLite without FTS5")
+        self.assertEqual(self._search("oil seepage"), ["capture-0"])
+        self.assertEqual(sorted(self._search("inspection report")), ["capture-0", "capture-1"])
+        # Quoting keeps FTS syntax in user input harmless
+        self.assertEqual(self._search('hose" OR "nothing'), [])
+        self.assertEqual(self._search("   "), [])
+
+    def test_substring_fallback(self):
+        self.assertEqual(self._search("seepage", full_text=False), ["capture-0"])
+        # Newest first without a ranking
+        self.assertEqual(self._search("Inspection", full_text=False), ["capture-1", "capture-0"])
+        self.assertEqual(self._search("missing", full_text=False), [])
+
+    def test_search_command(self):
+        settings = os.path.join(self.directory.name, "settings.json")
+        with open(settings, "w") as f:
+            json.dump({"archive_dir": self.archive_dir}, f)
+        output = os.path.join(self.directory.name, "results.jsonl")
+        with redirect_stderr(io.StringIO()):
+            self.assertEqual(main(["--settings", settings, "-o", output, "search", "belt"]), 0)
+        with open(output) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([record["id"] for record in records], ["capture-1"])
+        self.assertEqual(records[0]["title"], "Inspection Report 2")
+        self.assertTrue(os.path.exists(records[0]["image_path"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
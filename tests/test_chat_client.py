@@ -0,0 +1,78 @@
+import os
+import socket
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from capture_core import ChatClient, ChatPayload
+from stub_server import StubServer, reply, stall
+
+
+def _payload():
+    return ChatPayload([b"\x89PNG fake image"], "describe this")
+
+
+def _client(url, **options):
+    options.setdefault("connect_timeout", 0.5)
+    options.setdefault("read_timeout", 2)
+    options.setdefault("backoff", 0.01)
+    return ChatClient(url=url, **options)
+
+
+class ChatClientTests(unittest.TestCase):
+    def test_post_returns_json(self):
+        with StubServer(reply(200, {"assistant_message": "hello"})) as server:
+            client = _client(server.url)
+            self.assertEqual(client.post(_payload())["assistant_message"], "hello")
+            client.close()
+        self.assertEqual(server.requests[0]["conversation_history"][0]["content"], "describe this")
+
+    def test_retries_5xx_then_succeeds(self):
+        with StubServer(reply(503, {}), reply(503, {}), reply(200, {"assistant_message": "third"})) as server:
+            client = _client(server.url, retries=2)
+            self.assertEqual(client.post(_payload())["assistant_message"], "third")
+            client.close()
+        self.assertEqual(len(server.requests), 3)
+        summary = client.stats.summary()
+        self.assertEqual((summary["count"], summary["errors"]), (3, 2))
+
+    def test_5xx_beyond_retries_raises(self):
+        with StubServer(default=reply(503, {})) as server:
+            client = _client(server.url, retries=1)
+            with self.assertRaises(requests.exceptions.HTTPError):
+                client.post(_payload())
+            client.close()
+        self.assertEqual(len(server.requests), 2)
+
+    def test_read_timeout_raises_without_retry(self):
+        with StubServer(stall(3)) as server:
+            client = _client(server.url, read_timeout=0.5, retries=2)
+            started = time.perf_counter()
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                client.post(_payload())
+            elapsed = time.perf_counter() - started
+            client.close()
+        self.assertGreaterEqual(elapsed, 0.4)
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_refused_connection_gives_up_after_retries(self):
+        # A port that was just free has nobody listening on it
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        client = _client("http://127.0.0.1:%d/v1/chat" % port, retries=2)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.post(_payload())
+        client.close()
+        summary = client.stats.summary()
+        self.assertEqual((summary["count"], summary["errors"]), (3, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
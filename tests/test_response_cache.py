@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from capture_core import ResponseCache
+
+
+def _form(value, cursor=False):
+    image = Image.new("RGB", (640, 400), "white")
+    draw = ImageDraw.Draw(image)
+    for i in range(12):
+        draw.text((20, 20 + i * 24), f"Field {i}: value {i * 7}", fill="black")
+    draw.text((300, 100), f"Pressure: {value}", fill="black")
+    if cursor:
+        draw.line((400, 200, 400, 216), fill="black")
+    return image
+
+
+class ResponseCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _cache(self, **options):
+        return ResponseCache(self.directory.name, **options)
+
+    def _answer(self, cache, title, image, response):
+        key = ResponseCache.key("prompt", title, [image.tobytes()])
+        cache.put(key, response, title, cache.fingerprint(image))
+
+    def _lookup(self, cache, title, image):
+        key = ResponseCache.key("prompt", title, [image.tobytes()])
+        return cache.get(key, title, cache.fingerprint(image))
+
+    def test_exact_key_depends_on_title_and_bytes(self):
+        cache = self._cache()
+        self._answer(cache, "Report", _form(120), "answer")
+        self.assertEqual(self._lookup(cache, "Report", _form(120)), "answer")
+        self.assertIsNone(self._lookup(cache, "Other", _form(120)))
+
+    def test_exact_keys_persist(self):
+        self._answer(self._cache(), "Report", _form(120), "answer")
+        self.assertEqual(self._lookup(self._cache(), "Report", _form(120)), "answer")
+
+    def test_near_duplicate_within_threshold_hits(self):
+        cache = self._cache(near_cells=8)
+        self._answer(cache, "Report", _form(120), "answer")
+        self.assertEqual(self._lookup(cache, "Report", _form(120, cursor=True)), "answer")
+        self.assertEqual(cache.near_hits, 1)
+        # Scoped to the window title
+        self.assertIsNone(self._lookup(cache, "Other", _form(120, cursor=True)))
+
+    def test_different_forms_miss(self):
+        cache = self._cache(near_cells=0)
+        self._answer(cache, "Report", _form(120), "answer")
+        self.assertIsNone(self._lookup(cache, "Report", _form(125)))
+        self.assertIsNone(self._lookup(cache, "Report", _form(120, cursor=True)))
+
+    def test_near_lookup_off(self):
+        cache = self._cache(near_cells=None)
+        self.assertIsNone(cache.fingerprint(_form(120)))
+        self._answer(cache, "Report", _form(120), "answer")
+        self.assertIsNone(self._lookup(cache, "Report", _form(120, cursor=True)))
+
+
+if __name__ == "__main__":
+    unittest.main()
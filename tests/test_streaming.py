@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from capture_active_window import IncrementalMarkdown, MarkdownParser
+from capture_core import ChatClient, ChatPayload
+from stub_server import StubServer, chunks, reply
+
+RESPONSE = """## Inspector's Notes
+The unit shows **minor oil seepage** around the *rear main seal*.
+
+### Engine description
+- 2.0L inline four, turbocharged
+- Timing belt replaced at 90,000 km
+
+```
+code *stays* literal
+
+even across blank lines
+```
+
+| Part | Condition | Action |
+|------|:---------:|-------:|
+| **Gasket** | Worn | Replace |
+| Hose | OK | Monitor |
+
+Closing line with a [link](http://example.com).
+"""
+
+PIECES = ["## Insp", "ector's Notes\nThe unit ", "shows **minor", " oil seepage** around", " the end at 90 °C.\n"]
+
+
+def _stream(server_action):
+    with StubServer(server_action) as server:
+        client = ChatClient(url=server.url, connect_timeout=0.5, read_timeout=2, backoff=0.01)
+        payload = ChatPayload([b"\x89PNG fake image"], "describe this", stream=True)
+        try:
+            deltas = list(client.stream(payload))
+        finally:
+            client.close()
+    return deltas, server.requests[0]
+
+
+class ChatClientStreamTests(unittest.TestCase):
+    def test_server_sent_events(self):
+        lines = [": keep-alive comment\n\n", "event: message\n"]
+        lines += ["data: %s\n\n" % json.dumps({"delta": piece}) for piece in PIECES]
+        lines += ["data: [DONE]\n\n", "data: %s\n\n" % json.dumps({"delta": "after done"})]
+        deltas, request = _stream(chunks(lines, "text/event-stream", delay=0.01))
+        self.assertEqual(deltas, PIECES)
+        self.assertTrue(request["stream"])
+
+    def test_ndjson(self):
+        fields = ["delta", "content", "assistant_message", "delta", "content"]
+        lines = [json.dumps({field: piece}) + "\n" for field, piece in zip(fields, PIECES)]
+        deltas, _ = _stream(chunks(lines, "application/x-ndjson", delay=0.01))
+        self.assertEqual(deltas, PIECES)
+
+    def test_plain_chunked_text(self):
+        deltas, _ = _stream(chunks(PIECES, "text/plain; charset=utf-8", delay=0.01))
+        self.assertEqual("".join(deltas), "".join(PIECES))
+
+    def test_non_streaming_server_yields_whole_answer(self):
+        deltas, _ = _stream(reply(200, {"assistant_message": "whole answer"}))
+        self.assertEqual(deltas, ["whole answer"])
+
+
+class _RecordingText:
+    """Stands in for MarkdownText: keeps the applied runs and the stream_tail mark"""
+    def __init__(self):
+        self.runs = []
+        self.tail = 0
+
+    def config(self, **options):
+        pass
+
+    def delete(self, start, end):
+        del self.runs[0 if start != "stream_tail" else self.tail:]
+
+    def mark_set(self, name, index):
+        self.tail = len(self.runs)
+
+    def mark_gravity(self, name, direction):
+        pass
+
+    def apply_runs(self, runs):
+        self.runs.extend(runs)
+
+
+def _merged(runs):
+    """Adjacent runs with the same tags joined, so block splits don't matter"""
+    merged = []
+    for text, tags in runs:
+        tags = tuple(tags)
+        if merged and merged[-1][1] == tags:
+            merged[-1] = (merged[-1][0] + text, tags)
+        else:
+            merged.append((text, tags))
+    return merged
+
+
+class IncrementalMarkdownTests(unittest.TestCase):
+    def test_incremental_matches_one_shot_parse(self):
+        expected = _merged(MarkdownParser().parse(RESPONSE))
+        for step in (1, 3, 7, 64):
+            widget = _RecordingText()
+            renderer = IncrementalMarkdown(widget)
+            for end in range(step, len(RESPONSE) + step, step):
+                renderer.update(RESPONSE[:end])
+            renderer.update(RESPONSE, final=True)
+            self.assertEqual(_merged(widget.runs), expected, f"step {step}")
+
+    def test_completed_blocks_are_rendered_once(self):
+        widget = _RecordingText()
+        renderer = IncrementalMarkdown(widget)
+        renderer.update("First block.\n\nSecond")
+        stable = list(widget.runs[:widget.tail])
+        renderer.update("First block.\n\nSecond block grows")
+        self.assertTrue(stable)
+        self.assertEqual(widget.runs[:len(stable)], stable)
+        self.assertEqual(renderer.stable_len, len("First block.\n\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
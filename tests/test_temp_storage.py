@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_core import TempStorageManager
+
+FILE_BYTES = 1024
+MAX_AGE = 24 * 3600
+
+
+def _write(path, mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * FILE_BYTES)
+    os.utime(path, (mtime, mtime))
+
+
+def _files(directory):
+    return {os.path.join(parent, name): os.stat(os.path.join(parent, name)).st_mtime
+            for parent, _, names in os.walk(directory) for name in names}
+
+
+class TempStorageManagerTests(unittest.TestCase):
+    """Quota enforcement over a synthetic tree of thousands of files"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.root = os.path.join(self.directory.name, "tmp")
+        self.now = time.time()
+
+        # 16 sessions x 250 files; the first half is past the age quota
+        for session in range(16):
+            hours = 48 if session < 8 else 1
+            for i in range(250):
+                path = os.path.join(self.root, f"es_screenshots_{session:04d}", f"payload_{i}.json")
+                _write(path, self.now - hours * 3600 + session * 60 + i)
+        self.protect = os.path.join(self.root, "es_screenshots_0000")
+        self.unrelated = os.path.join(self.root, "other_app")
+        _write(os.path.join(self.unrelated, "keep.bin"), self.now - 72 * 3600)
+
+        # Fixed directories (like capture_archive/images) with nested shards
+        self.fixed = os.path.join(self.directory.name, "archive", "images")
+        for i in range(1000):
+            hours = 48 if i < 300 else 2
+            _write(os.path.join(self.fixed, f"{i % 16:02x}", f"{i}.png"), self.now - hours * 3600 + i)
+
+        self.protected_before = _files(self.protect)
+        self.newest = max(self._managed_files().items(), key=lambda item: item[1])[0]
+
+    def _managed_files(self):
+        files = {}
+        for name in os.listdir(self.root):
+            if name.startswith("es_screenshots_"):
+                files.update(_files(os.path.join(self.root, name)))
+        files.update(_files(self.fixed))
+        return files
+
+    def test_enforce_applies_both_quotas(self):
+        max_bytes = 1500 * FILE_BYTES
+        manager = TempStorageManager(self.root, max_bytes=max_bytes, max_age=MAX_AGE,
+                                     protect=[self.protect], paths=[self.fixed])
+        self.assertEqual(manager.usage()["files"], 16 * 250 + 1000)
+
+        removed, freed = manager.enforce()
+
+        remaining = self._managed_files()
+        cutoff = self.now - MAX_AGE
+        for path, mtime in remaining.items():
+            if not path.startswith(self.protect + os.sep):
+                self.assertGreaterEqual(mtime, cutoff, path)
+        self.assertLessEqual(len(remaining) * FILE_BYTES, max_bytes)
+        self.assertEqual(manager.last_usage["bytes"], len(remaining) * FILE_BYTES)
+        self.assertEqual(freed, removed * FILE_BYTES)
+
+        # The running session and other programs' files are untouched
+        self.assertEqual(_files(self.protect), self.protected_before)
+        self.assertTrue(os.path.exists(os.path.join(self.unrelated, "keep.bin")))
+        # The size quota removes oldest first
+        self.assertIn(self.newest, remaining)
+        self.assertTrue(os.path.isdir(self.fixed))
+
+    def test_fixed_directories_survive_being_emptied(self):
+        manager = TempStorageManager(None, max_bytes=0, max_age=MAX_AGE, paths=[self.fixed])
+        removed, _ = manager.enforce()
+        self.assertEqual(removed, 1000)
+        self.assertTrue(os.path.isdir(self.fixed))
+        self.assertEqual(os.listdir(self.fixed), [])  # emptied shards are removed
+        # Prefix directories are ignored without a root
+        self.assertEqual(len(_files(self.root)), 16 * 250 + 1)
+
+    def test_emptied_session_directories_are_removed(self):
+        manager = TempStorageManager(self.root, max_bytes=10 ** 12, max_age=MAX_AGE,
+                                     protect=[self.protect])
+        manager.enforce()
+        sessions = sorted(name for name in os.listdir(self.root) if name.startswith("es_screenshots_"))
+        self.assertEqual(sessions, ["es_screenshots_0000"] + [f"es_screenshots_{i:04d}" for i in range(8, 16)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from capture_active_window import tokenize_inline
+
+
+class TokenizeInlineTests(unittest.TestCase):
+    def test_plain_text(self):
+        self.assertEqual(tokenize_inline("plain text"), [("plain text", ())])
+        self.assertEqual(tokenize_inline(""), [])
+
+    def test_bold_and_italic(self):
+        self.assertEqual(
+            tokenize_inline("**b** and *i*"),
+            [("b", ("bold",)), (" and ", ()), ("i", ("italic",))],
+        )
+        self.assertEqual(tokenize_inline("***x***"), [("x", ("bold_italic",))])
+
+    def test_italic_inside_bold(self):
+        self.assertEqual(
+            tokenize_inline("**bold *and italic***"),
+            [("bold ", ("bold",)), ("and italic", ("bold_italic",))],
+        )
+
+    def test_bold_inside_italic(self):
+        self.assertEqual(
+            tokenize_inline("*a**b**c*"),
+            [("a", ("italic",)), ("b", ("bold_italic",)), ("c", ("italic",))],
+        )
+
+    def test_triple_opener_split_by_closers(self):
+        self.assertEqual(
+            tokenize_inline("***a** b*"),
+            [("a", ("bold_italic",)), (" b", ("italic",))],
+        )
+        self.assertEqual(
+            tokenize_inline("***a* b**"),
+            [("a", ("bold_italic",)), (" b", ("bold",))],
+        )
+
+    def test_unmatched_delimiters_stay_literal(self):
+        self.assertEqual(tokenize_inline("*a"), [("*", ()), ("a", ())])
+        self.assertEqual(tokenize_inline("a * b"), [("a ", ()), ("*", ()), (" b", ())])
+        self.assertEqual(tokenize_inline("**a*"), [("*", ()), ("a", ("italic",))])
+        self.assertEqual(tokenize_inline("*a**"), [("a", ("italic",)), ("*", ())])
+
+    def test_underscores_inside_words(self):
+        text = "".join(run for run, _ in tokenize_inline("snake_case_name"))
+        self.assertEqual(text, "snake_case_name")
+        self.assertTrue(all(tags == () for _, tags in tokenize_inline("snake_case_name")))
+        self.assertEqual(
+            tokenize_inline("__a__ _b_"),
+            [("a", ("bold",)), (" ", ()), ("b", ("italic",))],
+        )
+
+    def test_code_and_links(self):
+        self.assertEqual(
+            tokenize_inline("`*x*` [l*i*](u) *i*"),
+            [("*x*", ("code",)), (" ", ()), ("l*i*", ("link",)), (" ", ()), ("i", ("italic",))],
+        )
+
+    def test_many_unmatched_openers_is_linear(self):
+        line = "*a " * 8000 + "b* " * 8000
+        started = time.perf_counter()
+        runs = tokenize_inline(line)
+        elapsed = time.perf_counter() - started
+        self.assertEqual("".join(text for text, _ in runs), line.replace("*", ""))
+        # The old per-closer rescan took well over a second here
+        self.assertLess(elapsed, 0.5)
+
+    def test_unclosed_links_are_linear(self):
+        for line in ("[a " * 20000, "[a](" * 15000, "![x " * 15000):
+            started = time.perf_counter()
+            runs = tokenize_inline(line)
+            elapsed = time.perf_counter() - started
+            self.assertEqual("".join(text for text, _ in runs), line)
+            # A bracket-by-bracket rescan took about 11 s on the first line
+            self.assertLess(elapsed, 0.5)
+
+    def test_link_after_unclosed_bracket(self):
+        self.assertEqual(
+            tokenize_inline("[a [b](u) c"),
+            [("[a ", ()), ("b", ("link",)), (" c", ())],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()